@@ -43,14 +43,36 @@
 #   Make a better format for input file (more readable than JSON).
 
 import os
-import json
-import fifo
+import sys
+import mmap
+import functools
+import array
 import protocols
 import phys
 
+try:
+    import orjson as _json  # Much faster parsing when available
+except ImportError:
+    import json as _json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# int.bit_count() (a native popcount) is available from Python 3.10
+_HAS_BIT_COUNT = sys.version_info >= (3, 10)
+
+# Registers with at least this many (non-reserved) members are unpacked with NumPy
+# (if available).  Below this the fixed overhead of a NumPy call is not worth it.
+_NUMPY_MIN_MEMBERS = 8
+
 class MMPeriph():
     _CMD_WRITE = 0
     _CMD_READ  = 1
+    _CMD_WRITE_RANGE = 2
+    _CMD_READ_RANGE  = 3
+    _RX_BUF_LIMIT = 4096    # Unterminated bytes held before giving up and resetting the PHY
     def __init__(self, memoryMapFilename, protocol, phy, parent = None, queued = True):
         self.parent = parent
         interpreter = None
@@ -62,87 +84,267 @@ class MMPeriph():
             if ext.lower() == '.json':
                 print("It's a JSON")
                 interpreter = JSONRegisterMapReader(memoryMapFilename)
-        if interpreter != None:
+        if interpreter is not None:
             registers = interpreter.getRegisters()
-        self.queued = True if queued else false
+        self.queued = bool(queued)
         if self.queued:
-            self._cmdQueue = fifo.FIFO(bufferDepth = 10, blockOnFull = True)
+            self._cmdQueue = CmdRing(depth = 16)
         else:
             self._cmdQueue = None
+        self._commandCallback = None
         self.registerMap = RegisterMap(registers)
+        # Attribute names of parent setters/getters found so far, keyed by (regAddr, memberName)
+        self._setterAttrName = {}
+        self._getterAttrName = {}
+        self._parentDir = None
         self.initUI()
         self.protocol = protocol
         self.phy = phy
+        # Resolved once here rather than on every poll in readAndParseFromDevice()
+        self._responseBytes = protocol.responseBytes()
+        self._unpack = protocol.unpackResponse
+        self._unpackMany = getattr(protocol, 'unpackResponses', None)
+        self._findTerminator = getattr(protocol, 'findTerminator', None)
+        self._readResponse = getattr(phy, 'readResponse', None)
+        # Received bytes not yet terminated, and how far they have been scanned
+        self._rxBuf = bytearray()
+        self._rxScan = 0
         if not hasattr(self.phy, 'openDevice'):
             print("phy object is not compatible. Missing method 'openDevice'")
         else:
             self._ready = self.phy.openDevice()
 
     def setParent(self, parent):
+        """Set the parent object and bind its auto-named getters/setters.
+        Note that this rebuilds the getter/setter dicts, so any callbacks registered
+        manually with registerGetter()/registerSetter() must be registered afterwards."""
         self.parent = parent
+        self.initUI()
 
     def writeRegister(self, regAddr, regValue):
         #print("Please implement writeRegister(regAddr, regValue) according to your application.")
         msgEncoded = self.protocol.packMessageWriteRegister(regAddr, regValue)
-        return self.phy.transmit(msgEncoded)
+        return self._transmit(msgEncoded)
+
+    def writeRegisters(self, startAddr, regValues):
+        """Write the values in 'regValues' to consecutive registers starting at address
+        'startAddr' in a single message.  Requires a protocol which implements
+        packMessageWriteRegisters()."""
+        msgEncoded = self.protocol.packMessageWriteRegisters(startAddr, regValues)
+        return self._transmit(msgEncoded)
 
     def readRegister(self, regAddr):
         #print("Please implement readRegister(regAddr) according to your application.")
         msgEncoded = self.protocol.packMessageReadRegister(regAddr)
         #print("readRegister() regAddr {}. Msg = {}".format(regAddr, msgEncoded))
+        return self._transmit(msgEncoded)
+
+    def readRegisters(self, startAddr, count):
+        """Read 'count' consecutive registers starting at address 'startAddr' with a
+        single message.  Requires a protocol which implements packMessageReadRegisters()."""
+        msgEncoded = self.protocol.packMessageReadRegisters(startAddr, count)
+        return self._transmit(msgEncoded)
+
+    def _transmit(self, msgEncoded):
+        """Transmit 'msgEncoded' and return the PHY's result, or None if the protocol
+        could not pack the message (e.g. address out of range) so nothing was sent."""
+        if msgEncoded is None:
+            return None
         return self.phy.transmit(msgEncoded)
 
     def readAndParseFromDevice(self):
-        msg = self.phy.readResponse(self.protocol.responseBytes())
-        if msg != None and len(msg) > 0:
-            regAddr, regVal = self.protocol.unpackResponse(msg)
+        """Poll the PHY for a response and pass any register values in it on to the
+        register map and UI.  Returns True if a register value was received."""
+        msg = self._readResponse(self._responseBytes)
+        if msg is None or len(msg) == 0:
+            #print("readAndParseFromDevice() msg = None")
+            return False
+        if self._findTerminator is not None:
+            # Hold on to bytes until complete (terminated) responses have arrived,
+            # only scanning the bytes added since the last call
+            buf = self._rxBuf
+            buf += msg
+            end = 0
+            i = self._findTerminator(buf, self._rxScan)
+            while i is not None:
+                end = i
+                i = self._findTerminator(buf, end)
+            if end == 0:
+                if len(buf) > self._RX_BUF_LIMIT:
+                    self._resetRx()
+                else:
+                    self._rxScan = len(buf)
+                return False
+            msg = bytes(buf[:end])
+            del buf[:end]
+            self._rxScan = len(buf)
+        if self._unpackMany is not None:
+            # The message may carry several registers (e.g. a burst read response)
+            pairs = self._unpackMany(msg)
+        else:
+            pairs = (self._unpack(msg),)
+        parsed = False
+        for regAddr, regVal in (pairs or ()):
             #print("readAndParseFromDevice() regAddr {}, regVal {}".format(regAddr, regVal))
-            if regAddr != None:
+            if regAddr is not None:
                 self.handleReadResponse(regAddr, regVal)
-            else:
-                # If a message is returned, but not properly parsed, a PHY reset is triggered.
-                self.phy.reset()
-        else:
-            #print("readAndParseFromDevice() msg = None")
-            pass
-
-    def processQueue(self):
-        """Call this periodically to shift calls through the FIFO (if using)."""
-        cmd = self._cmdQueue.load()
-        rval = False
-        if cmd != None:
-            #print("cmd = {}".format(cmd))
-            rw, regAddr, regVal = cmd
+                parsed = True
+        if not parsed:
+            # If a message is returned, but not properly parsed, a PHY reset is triggered.
+            self._resetRx()
+        return parsed
+
+    def _resetRx(self):
+        del self._rxBuf[:]
+        self._rxScan = 0
+        self.phy.reset()
+
+    def processQueue(self, maxOps = 16):
+        """Call this periodically to shift calls through the FIFO (if using).
+        Up to 'maxOps' queued commands are sent per call.  Queued writes to consecutive
+        addresses are merged into a single burst write if the protocol supports it.
+        Returns the number of queued commands sent."""
+        cmdQueue = self._cmdQueue
+        if cmdQueue is None:
+            return 0    # Not queued; commands were sent immediately
+        canMerge = hasattr(self.protocol, 'packMessageWriteRegisters')
+        nSent = 0
+        while nSent < maxOps:
+            cmd = cmdQueue.load()
+            if cmd is None:
+                break
+            rw, regAddr, regVal = cmd.rw, cmd.addr, cmd.val
+            nCmds = 1
+            rval = False
             if rw == self._CMD_READ:
                 rval = self.readRegister(regAddr)
             elif rw == self._CMD_WRITE:
-                rval = self.writeRegister(regAddr, regVal)
-            if rval:
-                # If the command was successful, increment the queue
-                self._cmdQueue.inc()
+                regValues = None
+                if canMerge:
+                    regValues = self._mergeQueuedWrites(regAddr, regVal, maxOps - nSent)
+                if regValues is not None:
+                    rval = self.writeRegisters(regAddr, regValues)
+                    nCmds = len(regValues)
+                else:
+                    rval = self.writeRegister(regAddr, regVal)
+            elif rw == self._CMD_WRITE_RANGE:
+                rval = self.writeRegisters(regAddr, regVal)
+            elif rw == self._CMD_READ_RANGE:
+                rval = self.readRegisters(regAddr, regVal)
+            if rval is None:
+                # Could never be sent; drop it rather than retry forever
+                cmdQueue.inc(nCmds)
+                continue
+            if not rval:
+                # Leave the command queued to try again on the next call
+                break
+            # If the command was successful, increment the queue
+            cmdQueue.inc(nCmds)
+            nSent += nCmds
+        return nSent
+
+    def _mergeQueuedWrites(self, startAddr, startVal, maxCount):
+        """Collect the values of up to 'maxCount' queued single writes (starting with
+        the one at the head of the queue) to consecutive addresses from 'startAddr'.
+        Returns a tuple of the values if more than one write can be merged, else None."""
+        stride = self.protocol.addressStride()
+        regValues = [startVal]
+        nextAddr = startAddr + stride
+        while len(regValues) < maxCount:
+            cmd = self._cmdQueue.load(len(regValues))
+            if (cmd is None) or (cmd.rw != self._CMD_WRITE) or (cmd.addr != nextAddr):
+                break
+            regValues.append(cmd.val)
+            nextAddr += stride
+        if len(regValues) > 1:
+            return tuple(regValues)
+        return None
 
     def addReadToQueue(self, regAddr):
         #print("addReadToQueue({})".format(hex(regAddr)))
         if self.queued:
-            self._cmdQueue.add((self._CMD_READ, regAddr, 0))
+            self._cmdQueue.add(self._CMD_READ, regAddr, 0)
         else:
             self.readRegister(regAddr)
+        self._commandAdded()
+        return 0
+
+    def addReadRangeToQueue(self, startAddr, count):
+        """Queue a burst read of 'count' consecutive registers starting at address
+        'startAddr'."""
+        if self.queued:
+            self._cmdQueue.add(self._CMD_READ_RANGE, startAddr, count)
+        else:
+            self.readRegisters(startAddr, count)
+        self._commandAdded()
         return 0
 
     def addWriteToQueue(self, regAddr, regVal):
         #print("addWriteToQueue({}, {})".format(hex(regAddr), hex(regVal)))
         if self.queued:
-            self._cmdQueue.add((self._CMD_WRITE, regAddr, regVal))
+            self._cmdQueue.add(self._CMD_WRITE, regAddr, regVal)
         else:
             self.writeRegister(regAddr, regVal)
+        self._commandAdded()
         return
 
+    def addWriteRangeToQueue(self, startAddr, regValues):
+        """Queue a burst write of 'regValues' to consecutive registers starting at
+        address 'startAddr'."""
+        regValues = tuple(regValues)
+        if self.queued:
+            self._cmdQueue.add(self._CMD_WRITE_RANGE, startAddr, regValues)
+        else:
+            self.writeRegisters(startAddr, regValues)
+        self._commandAdded()
+        return
+
+    def setCommandCallback(self, callback):
+        """Set a function (taking no arguments) to be called whenever a command is added
+        to the queue (or sent, if not queued), e.g. to wake up an idle polling loop.
+        Pass None to remove it."""
+        self._commandCallback = callback
+
+    def _commandAdded(self):
+        if self._commandCallback is not None:
+            self._commandCallback()
+
+    def queueEmpty(self):
+        """Return True if there are no queued commands waiting to be sent."""
+        return (self._cmdQueue is None) or self._cmdQueue.isEmpty()
+
     def requestNewRegisterValues(self, regAddressList):
-        if hasattr(regAddressList, '__len__'):
+        if not hasattr(regAddressList, '__len__'):
+            self.addReadToQueue(regAddressList)
+        elif hasattr(self.protocol, 'packMessageReadRegisters'):
+            # Coalesce runs of contiguous addresses into burst reads
+            for startAddr, count in self._coalesceAddresses(regAddressList):
+                if count == 1:
+                    self.addReadToQueue(startAddr)
+                else:
+                    self.addReadRangeToQueue(startAddr, count)
+        else:
             for regAddr in regAddressList:
                 self.addReadToQueue(regAddr)
-        else:
-            self.addReadToQueue(regAddressList)
+
+    def _coalesceAddresses(self, addrList):
+        """Sort the register addresses in 'addrList' and group them into runs of
+        contiguous registers.  Returns a list of (startAddr, count) pairs."""
+        stride = self.protocol.addressStride()
+        runs = []
+        startAddr = None
+        count = 0
+        for addr in sorted(set(addrList)):
+            if startAddr is not None and addr == startAddr + stride*count:
+                count += 1
+                continue
+            if startAddr is not None:
+                runs.append((startAddr, count))
+            startAddr = addr
+            count = 1
+        if startAddr is not None:
+            runs.append((startAddr, count))
+        return runs
 
     def handleReadResponse(self, regAddr, regValue):
         """This should be called from the device-specific message reception API
@@ -154,32 +356,62 @@ class MMPeriph():
         """Parse a message into member name, value pairs and call parent callbacks
         if they are registered."""
         #self.distributeToSetters(regAddr, regValue)
-        memberDict = self.registerMap.getRegisterValueAsMembers(regAddr)
-        if memberDict == None:
-            return
-        for memberName, value in memberDict.items():
-            setter = self.getSetter(regAddr, memberName)
-            if setter != None:
-                setter(value)
+        regSetter = self._registerSetters.get(regAddr, None)
+        if regSetter is not None:
+            regSetter(regValue)
+        lastUI = self._lastUI
+        for setter, shift, mask, key in self._readDispatch.get(regAddr, ()):
+            val = (regValue >> shift) & mask
+            setter(val)
+            # The UI now shows the device's value, so a getter returning anything else
+            # (even a value the user entered before) is a change to send
+            lastUI[key] = val
+
+    def _buildReadDispatch(self, regAddr):
+        """Cache a tuple of (setter, shift, mask, (regAddr, memberName)) for each member of register at address
+        'regAddr' which has a setter, so a read response can be passed to the UI without
+        any lookups.  Must be called whenever self.setters[regAddr] changes."""
+        register = self.registerMap.getRegisterByAddress(regAddr)
+        regSetters = self.setters.get(regAddr, {})
+        dispatch = []
+        if register is not None:
+            for member in register.getMembers():
+                memberName = register.getName(member)
+                setter = regSetters.get(memberName, None)
+                if setter is not None:
+                    dispatch.append((setter, register.getOffset(member), (1 << register.getWidth(member)) - 1,
+                                     (regAddr, memberName)))
+        self._readDispatch[regAddr] = tuple(dispatch)
 
     def initUI(self):
         self.setters = {} # Nested dicts
         self.getters = {} # Nested dicts
+        self._lastUI = {}   # (regAddr, memberName): last value read from getters
+        # Collect the parent's attribute names once so failed probes are just set lookups
+        self._parentDir = set(dir(self.parent)) if self.parent is not None else None
         # For each register in the map,
-        for regAddr in self.registerMap:
-            register = self.registerMap.getRegisterByAddress(regAddr)
+        parentAttrs = self._parentDir
+        for regAddr, register in self.registerMap.getRegisters():
+            regSetters = self.setters[regAddr] = {}
+            regGetters = self.getters[regAddr] = {}
+            if self.parent is None:
+                # No parent (yet) means no auto-named getters/setters to find.
+                # setParent() will call initUI() again.
+                continue
             registerName = register.name()
-            self.setters[regAddr] = {}
-            self.getters[regAddr] = {}
             # For each member in the register
             for member in register.getMembers():
                 memberName = register.getName(member)
-                setter = self.getParentSetter(regAddr, registerName, memberName)
-                if setter != None:
-                    self.setters[regAddr][memberName] = setter
-                getter = self.getParentGetter(regAddr, registerName, memberName)
-                if getter != None:
-                    self.getters[regAddr][memberName] = getter
+                setter = self.getParentSetter(regAddr, registerName, memberName, parentAttrs)
+                if setter is not None:
+                    regSetters[memberName] = setter
+                getter = self.getParentGetter(regAddr, registerName, memberName, parentAttrs)
+                if getter is not None:
+                    regGetters[memberName] = getter
+        self._registerSetters = {}  # Whole-register setters (see registerRegisterSetter())
+        self._readDispatch = {}
+        for regAddr in self.setters:
+            self._buildReadDispatch(regAddr)
 
     def registerGetter(self, registerAddrname, memberName, callback):
         """Manually register a getter callback function (rather than doing it with
@@ -187,7 +419,7 @@ class MMPeriph():
         'registerAddrname' could be an address (int) or a name (str)."""
         if isinstance(registerAddrname, str):
             regAddr = self.registerMap.getRegisterAddressByName(registerAddrname)
-            if regAddr == None:
+            if regAddr is None:
                 return False
         elif isinstance(registerAddrname, int):
             regAddr = registerAddrname
@@ -202,84 +434,140 @@ class MMPeriph():
         'registerAddrname' could be an address (int) or a name (str)."""
         if isinstance(registerAddrname, str):
             regAddr = self.registerMap.getRegisterAddressByName(registerAddrname)
-            if regAddr == None:
+            if regAddr is None:
                 return False
         elif isinstance(registerAddrname, int):
             regAddr = registerAddrname
         else:
             return False
         self.setters[regAddr][memberName] = callback
+        self._buildReadDispatch(regAddr)
         return True
 
-    def getParentSetter(self, registerAddress, registerName, memberName):
+    def registerRegisterSetter(self, registerAddrname, callback):
+        """Register a single callback function which receives the whole value of the
+        register each time it is read (e.g. to update all of its members at once).
+        This is called before any per-member setters.  Replaces any previous register
+        setter for the same register.
+        'registerAddrname' could be an address (int) or a name (str)."""
+        if isinstance(registerAddrname, str):
+            regAddr = self.registerMap.getRegisterAddressByName(registerAddrname)
+            if regAddr is None:
+                return False
+        elif isinstance(registerAddrname, int):
+            regAddr = registerAddrname
+        else:
+            return False
+        self._registerSetters[regAddr] = callback
+        return True
+
+    def getParentSetter(self, registerAddress, registerName, memberName, parentAttrs = None):
         """Search for an return if found a setter method for the given member of name
         'memberName' in register at address 'registerAddress' (with name 'registerName')
-        according to the auto getter/setter naming protocol."""
+        according to the auto getter/setter naming protocol.
+        'parentAttrs' is an optional set of the parent's attribute names (see initUI())."""
         # TODO enable a greater variety of names and CENTRALIZE the naming rule
-        if self.parent == None:
+        if self.parent is None:
             return None
-        targetNames = ("set" + registerName + memberName,
-                       "setRegister" + str(registerAddress) + memberName)
-        for targetName in targetNames:
-            target = getattr(self.parent, targetName, None)
-            if target != None:
-                # TODO - ensure it's callable and can take one arg?
-                return target
-        return None
+        return self._findParentAttr(self._setterAttrName, "set", registerAddress, registerName,
+                                    memberName, parentAttrs)
 
-    def getParentGetter(self, registerAddress, registerName, memberName):
+    def getParentGetter(self, registerAddress, registerName, memberName, parentAttrs = None):
         """Search for an return if found a setter method for the given member of name
         'memberName' in register at address 'registerAddress' (with name 'registerName')
-        according to the auto getter/setter naming protocol."""
+        according to the auto getter/setter naming protocol.
+        'parentAttrs' is an optional set of the parent's attribute names (see initUI())."""
         # TODO enable a greater variety of names and CENTRALIZE the naming rule
-        if self.parent == None:
+        if self.parent is None:
             return None
-        targetNames = ("get" + registerName + memberName,
-                       "getRegister" + str(registerAddress) + memberName)
-        for targetName in targetNames:
-            target = getattr(self.parent, targetName, None)
-            if target != None:
-                # TODO - ensure it's callable?
+        return self._findParentAttr(self._getterAttrName, "get", registerAddress, registerName,
+                                    memberName, parentAttrs)
+
+    def _findParentAttr(self, attrNameCache, prefix, registerAddress, registerName, memberName, parentAttrs):
+        """Return the parent's attribute "<prefix><registerName><memberName>" or failing that
+        "<prefix>Register<registerAddress><memberName>" (or None if neither exists).
+        The name that matched is remembered in 'attrNameCache' so that re-resolving the
+        same member only needs a single lookup."""
+        # TODO - ensure it's callable (and a setter can take one arg)?
+        key = (registerAddress, memberName)
+        cachedName = attrNameCache.get(key)
+        if cachedName is not None:
+            target = getattr(self.parent, cachedName, None)
+            if target is not None:
                 return target
-        return None
+        if parentAttrs is None:
+            parentAttrs = self._parentDir
+        # The second candidate name is only built if the first isn't found
+        targetName = f"{prefix}{registerName}{memberName}"
+        target = self._getParentAttr(targetName, parentAttrs)
+        if target is None:
+            targetName = f"{prefix}Register{registerAddress}{memberName}"
+            target = self._getParentAttr(targetName, parentAttrs)
+        if target is not None:
+            attrNameCache[key] = targetName
+        return target
+
+    def _getParentAttr(self, name, parentAttrs):
+        if (parentAttrs is not None) and (name not in parentAttrs):
+            return None     # Skip the getattr() on a known miss
+        return getattr(self.parent, name, None)
 
     def setChangesFromUI(self):
         """This should be called periodically in a user interface to update the value
         of the register members with getter functions (pre-registered with initUI() or
         with registerGetter())"""
-        regDoubleDict = self.getUIValues()
+        regDoubleDict = {}
+        for regAddr, memberName, val in self.getUIValues():
+            regDict = regDoubleDict.get(regAddr)
+            if regDict is None:
+                regDict = regDoubleDict[regAddr] = {}
+            regDict[memberName] = val
+        # Only registers with a member changed in the UI are touched
         for regAddr, regDict in regDoubleDict.items():
             #self.registerMap.setRegisterChangeDict(regAddr, regDict)
             self.registerMap.setRegisterIfChanged(regAddr, regDict)
 
     def getUIValues(self):
-        regDict = {} # Nested dicts
-        if self.parent == None:
-            return regDict
-        for regAddr in self.registerMap:
-            #register = self.registerMap.getRegisterByAddress(regAddr)
-            regDict[regAddr] = {}
-            for memberName, getter in self.getters[regAddr].items():
-                if getter != None:
+        """Generate (regAddr, memberName, value) for each UI value (from the getters)
+        which differs from the value seen on the previous call."""
+        if self.parent is None:
+            return
+        lastUI = self._lastUI
+        getLast = lastUI.get
+        for regAddr, regGetters in self.getters.items():
+            for memberName, getter in regGetters.items():
+                if getter is not None:
                     val = getter()  # Just call the getter for now
-                    if val != None:
-                        regDict[regAddr][memberName] = val
-        return regDict
+                    if val is not None:
+                        key = (regAddr, memberName)
+                        if val != getLast(key):
+                            lastUI[key] = val
+                            yield regAddr, memberName, val
 
     def sendChangesToDevice(self, openLoop = False):
         changeDict = self.registerMap.getChangedRegisters()
-        for addr, newVal in changeDict.items():
-            self.addWriteToQueue(addr, newVal)
+        if hasattr(self.protocol, 'packMessageWriteRegisters'):
+            # Coalesce runs of contiguous addresses into burst writes
+            stride = self.protocol.addressStride()
+            for startAddr, count in self._coalesceAddresses(changeDict.keys()):
+                if count == 1:
+                    self.addWriteToQueue(startAddr, changeDict[startAddr])
+                else:
+                    regValues = [changeDict[startAddr + stride*n] for n in range(count)]
+                    self.addWriteRangeToQueue(startAddr, regValues)
+        else:
+            for addr, newVal in changeDict.items():
+                self.addWriteToQueue(addr, newVal)
         if openLoop:
             self.registerMap.commitChanges()
         else:
-            self.requestNewRegisterValues([x for x in changeDict.keys()])
+            self.requestNewRegisterValues(list(changeDict.keys()))
 
     def getGetter(self, regAddr, memberName):
         """Get a pre-registered getter function by register address 'regAddr' and
         member name 'memberName'."""
         regGetters = self.getters.get(regAddr, None)
-        if regGetters != None:
+        if regGetters is not None:
             return regGetters.get(memberName, None)
         return None
 
@@ -287,7 +575,7 @@ class MMPeriph():
         """Get a pre-registered setter function by register address 'regAddr' and
         member name 'memberName'."""
         regSetters = self.setters.get(regAddr, None)
-        if regSetters != None:
+        if regSetters is not None:
             return regSetters.get(memberName, None)
         return None
 
@@ -312,6 +600,78 @@ class MMPeriph():
                 print("Reg {} Member {}".format(regAddr, memberName))
         print()
 
+class CmdRing():
+    """A preallocated ring buffer of register commands for a single producer and a
+    single consumer.  Commands are stored in parallel arrays of command code, register
+    address and value so that queueing a command does not allocate.  The depth is
+    rounded up to a power of two so that indices wrap with a mask.
+    Values are kept in a list rather than an array because a burst write carries a
+    tuple of register values."""
+    def __init__(self, depth = 16):
+        size = 1
+        while size < depth:
+            size <<= 1
+        self._depth = size
+        self._mask = size - 1
+        self._cmds = array.array('B', bytes(size))
+        self._addrs = array.array('Q', bytes(8*size))
+        self._vals = [0]*size
+        self._head = 0      # Count of commands consumed
+        self._tail = 0      # Count of commands added
+        self._record = _CmdRecord()
+
+    def add(self, rw, addr, val):
+        """Add a command to the ring.  Returns False (command not added) if full."""
+        if self._tail - self._head == self._depth:
+            return False
+        n = self._tail & self._mask
+        self._cmds[n] = rw
+        self._addrs[n] = addr
+        self._vals[n] = val
+        self._tail += 1
+        return True
+
+    def load(self, offset = 0):
+        """Get the next command (or the one 'offset' places behind it) without removing
+        it from the ring.  Call inc() once it has been processed.  Returns None if there
+        is no such command.
+        NOTE: The returned record is reused; it is only valid until the next load()."""
+        if offset >= self._tail - self._head:
+            return None
+        n = (self._head + offset) & self._mask
+        record = self._record
+        record.rw = self._cmds[n]
+        record.addr = self._addrs[n]
+        record.val = self._vals[n]
+        return record
+
+    def inc(self, count = 1):
+        """Remove the next 'count' commands from the ring."""
+        count = min(count, self._tail - self._head)
+        for _ in range(count):
+            self._vals[self._head & self._mask] = 0     # Drop any reference to burst values
+            self._head += 1
+        return
+
+    def reset(self):
+        self._head = self._tail = 0
+
+    def isEmpty(self):
+        return self._head == self._tail
+
+    def isFull(self):
+        return self._tail - self._head == self._depth
+
+    def __len__(self):
+        return self._tail - self._head
+
+class _CmdRecord():
+    __slots__ = ('rw', 'addr', 'val')
+    def __init__(self):
+        self.rw = 0
+        self.addr = 0
+        self.val = 0
+
 class RegisterMap():
     """Use with a memory-mapped peripheral for register access.
     To update a device after changes from the user, use:
@@ -323,10 +683,14 @@ class RegisterMap():
     If you are not doing the writing (above) on a tight loop, you can
     skip 'self.clearChanges()' and allow a subsequent read to confirm
     that the value has been updated.
-    WARNING! This is tricky with registers that are not R/W in nature."""
+    WARNING! This is tricky with registers that are not R/W in nature.
+
+    Changes should be posted through the setRegister*() methods so the map can
+    keep track of which registers are dirty."""
     def __init__(self, registerList):
         self.regDict = {}
         self.registerWidth = 0
+        self._dirty = set()     # Addresses of registers with pending changes
         print("RegisterMap got a list of {} registers".format(len(registerList)))
         for register in registerList:
             # Make a dict of addr : register object pairs
@@ -343,6 +707,13 @@ class RegisterMap():
                 print("WARNING! Overwriting register {} at addres {} with {}!".format(
                     existingRegisterName, addr, thisRegisterName))
             self.regDict[addr] = register
+        # Reverse index for name lookups (first register wins on duplicate names)
+        self._nameToAddr = {}
+        for addr, register in self.regDict.items():
+            self._nameToAddr.setdefault(register.name(), addr)
+        # The map doesn't change after construction so the iteration orders can be fixed
+        self._addrTuple = tuple(self.regDict.keys())
+        self._items = tuple(self.regDict.items())
         print("Parsed {} registers".format(len(self.regDict)))
 
     def getWidth(self):
@@ -352,53 +723,64 @@ class RegisterMap():
         return len(self.regDict)
 
     def __iter__(self):
-        return iter(self.regDict)
+        return iter(self._addrTuple)
 
     def __next__(self):
         return next(self.regDict)
 
     def getRegisters(self):
-        return self.regDict.items()
+        """Return a tuple of (addr, register) pairs."""
+        return self._items
 
     def getRegisterByAddress(self, addr):
         return self.regDict.get(addr, None)
 
     def getRegisterAddressByName(self, regName):
-        for addr, register in self.regDict.items():
-            if regName == register.name():
-                return addr
-        return None
+        return self._nameToAddr.get(regName, None)
 
     def getRegValueDict(self):
         valDict = {}
-        for addr, register in self.regDict.items():
+        for addr, register in self._items:
             value = register.value()
             valDict[addr] = value
         return valDict
 
     def getChangedRegisters(self, autoClear = False):
         valDict = {}
-        for addr, register in self.regDict.items():
+        for addr in sorted(self._dirty):
+            register = self.regDict[addr]
             if register.isChanged():
                 nextVal = register.nextValue()
                 valDict[addr] = nextVal
                 if autoClear:
                     register.resetChanges()
+                    self._dirty.discard(addr)
+            else:
+                # Changes were cleared on the register itself
+                self._dirty.discard(addr)
         return valDict
 
+    def _updateDirty(self, regAddr, register):
+        if register.isChanged():
+            self._dirty.add(regAddr)
+        else:
+            self._dirty.discard(regAddr)
+
     def clearChanges(self):
-        for addr, register in self.regDict.items():
+        for addr, register in self._items:
             register.resetChanges()
+        self._dirty.clear()
         return
 
     def commitChanges(self):
-        for addr, register in self.regDict.items():
-            register.commitChanges()
+        for addr in self._dirty:
+            self.regDict[addr].commitChanges()
+        self._dirty.clear()
         return
 
     def __str__(self):
         s = []
-        for addr, register in self.regDict.items():
+        for addr, register in self._items:
             s.append(str(register))
         return '\n'.join(s)
 
@@ -408,10 +790,11 @@ class RegisterMap():
         has arrived from the device, NOT when the user wants to make a register change
         (use self.setRegisterChange() for that)."""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("setRegisterChange() Unknown register referenced: {}".format(regAddr))
             return
         register.set(regValue)
+        self._dirty.discard(regAddr)
 
     def setRegisterChangeDict(self, regAddr, regDict):
         """Post changes from the members of the local copy of register at address 'regAddr'
@@ -419,53 +802,72 @@ class RegisterMap():
         the value of individual members within registers have changed and the changes are
         posted to the register to eventually update the device."""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("setRegisterChangeDict() Unknown register referenced: {}".format(regAddr))
             return
         register.setChangeDict(regDict)
+        self._updateDirty(regAddr, register)
 
     def setRegisterIfChanged(self, regAddr, regDict):
         """Set the change dict for register at 'regAddr' if the resulting value is different
         than the previously stored value."""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("setRegisterIfChanged() Unknown register referenced: {}".format(regAddr))
             return
         register.setChangeDictIfChanged(regDict)
+        self._updateDirty(regAddr, register)
 
     def setRegisterChange(self, regAddr, newRegisterValue):
         """If a whole register value has been changed (i.e. by the user), the change can
         be set in the register by address via this function.  The change will be stored
         for later use by a device updater function with self.getChangedRegisters()"""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("setRegisterChange() Unknown register referenced: {}".format(regAddr))
             return
         register.setChange(newRegisterValue)
+        self._updateDirty(regAddr, register)
 
     def setRegisterMemberChange(self, regAddr, memberName, newMemberValue):
         """This function can be used to post a change to a single member (by name 'memberName')
         inside register at address 'regAddr'.  The change will be stored for later use
         by a device updater function with self.getChangedRegisters()"""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("setRegisterMemberChange() Unknown register referenced: {}".format(regAddr))
             return
         register.setChangeByName(memberName, newMemberValue)
+        self._updateDirty(regAddr, register)
 
     def getRegisterValueAsMembers(self, regAddr):
         """Return a dict of {memberName : memberValue} pairs from register at address 'regAddr'."""
         register = self.regDict.get(regAddr, None)
-        if register == None:
+        if register is None:
             print("getRegisterValueAsMembers() Unknown register referenced: {}".format(regAddr))
             return None
-        members = register.getMembers()
-        memberDict = {}
-        for member in members:
-            name = register.getName(member)
-            value = register.getValue(member)
-            memberDict[name] = value
-        return memberDict
+        return register.getMemberValues()
+
+class _Member():
+    """A single bit field of a Register.  Use the Register accessors (getName(),
+    getOffset(), etc) rather than the attributes directly."""
+    __slots__ = ('name', 'offset', 'width', 'mask', 'shift', 'permissions', 'value', 'desc', 'reserved',
+                 'spanLabel')
+    def __init__(self, name, offset, width, permissions, value, desc, reserved = False):
+        self.name = name
+        self.offset = offset
+        self.width = width
+        self.mask = ((1 << width) - 1) << offset
+        self.shift = offset
+        self.permissions = permissions
+        self.value = value
+        self.desc = desc
+        self.reserved = reserved
+        # Bit span label e.g. "[3]" or "[7:4]" (static, so formatted once)
+        if width == 1:
+            self.spanLabel = "[{}]".format(offset)
+        else:
+            self.spanLabel = "[{}:{}]".format(offset + width - 1, offset)
 
 class Register():
     """Pythonic representation of an N-bit register which contains
@@ -498,12 +900,18 @@ class Register():
         the change dict.  If the values are equal, the entry is
         removed from the change dict.
 
-    The member objects themselves are simple dicts but to access
-    their attributes, you should use the class APIs:
+    The member objects themselves are simple _Member objects but to
+    access their attributes, you should use the class APIs:
         self.getName(member)
         self.getWidth(member)
         self.getOffset(member)
     """
+    __slots__ = ('_name', '_addr', '_addrHex', '_size', 'permissions',
+                 '_flags', 'members', 'changeDict', '_lock', '_usedMask',
+                 '_names', '_offsets', '_widths', '_masks', '_perms', '_memberNames', '_shifts',
+                 '_decoderTriples', '_npShifts', '_npMasks', '_memberCache', '_userMemberCache',
+                 '_byName', '_valueArr', '_offsetArr', '_maskArr', '_npIndex', '_npUserIdx',
+                 '_allMembers', '_allMembersBE', '_userMembers')
     _RESERVED_PREFIXES = ("RESERVED", "_")
     _sNAME = "name"
     _sWIDTH = "width"
@@ -514,72 +922,81 @@ class Register():
 
     _bmREAD = 1
     _bmWRITE = 2
+    # Bits of Register._flags
+    _fREADABLE = 1
+    _fWRITEABLE = 2
     _aPERMISSIONS = {
         "r" : _bmREAD,
         "w" : _bmWRITE
         }
+    # Permission bitmask by character code (both cases) for _parsePermissionString()
+    _PERM_LUT = bytearray(256)
+    for _c, _p in _aPERMISSIONS.items():
+        _PERM_LUT[ord(_c.lower())] = _p
+        _PERM_LUT[ord(_c.upper())] = _p
+    _PERM_LUT = bytes(_PERM_LUT)
+    del _c, _p
+
     def __init__(self, name, addr, size, memberList, permissionString = None):
         self._name = name
         self._addr = _int(addr)
+        self._addrHex = hex(self._addr)
         self._size = _int(size)
-        self._32bitmask = True
-        self._readMemberList = memberList
         self.permissions = self._parsePermissionString(permissionString)
-        self._readable = self._permissionsIsRead(self.permissions)
-        self._writeable = self._permissionsIsWrite(self.permissions)
-        # Each member will be a dict of attributes 'name', 'size', 'order', and 'offset'
-        # Order and offset are sort of redundant, but it's nice to have both pre-calculated
+        self._flags = 0
+        if self._permissionsIsRead(self.permissions):
+            self._flags |= self._fREADABLE
+        if self._permissionsIsWrite(self.permissions):
+            self._flags |= self._fWRITEABLE
+        # Each member will be a _Member with its name, offset, width, mask, permissions, etc.
+        # The mask (and shift) are redundant with offset/width, but it's nice to have them pre-calculated
         self.members = []
         self.changeDict = {}
         self._lock = False
-        for member in self._readMemberList:
+        for member in memberList:
             name = member.get(self._sNAME, None)
             desc = member.get(self._sDESC, None)
             offset = member.get(self._sOFFSET, None)
             width = member.get(self._sWIDTH, None)
             rpermissions = member.get(self._sPERMISSIONS, None)
-            if rpermissions == None:     # Inherit from register permissions if not set individually
+            if rpermissions is None:     # Inherit from register permissions if not set individually
                 rpermissions = permissionString
             rpermissions = self._parsePermissionString(rpermissions)
             value = member.get(self._sVALUE, None)
             self._addMember(name, offset, width, permissions = rpermissions, value = value, description = desc)
         # Ensure the members list is sorted by the order in which they are read - this should be redundant but safe
         #print("Register {} has {} members".format(self._name, len(self.members)))
-        self.members.sort(key = lambda x: x[self._sOFFSET])
+        self.members.sort(key = lambda x: x.offset)
         self.checkValidity()
+        self._usedMask = self._getUsedMask()
         self.reserveBits()
         self.sortMembers()
+        self._buildMemberArrays()
         self._lock = True
 
     @classmethod
     def _parsePermissionString(cls, pString):
-        permissions = 0
         if not hasattr(pString, "__len__"):
             return pString
-        for c in pString:
-            p = cls._aPERMISSIONS.get(c.lower(), None)
-            if p != None:
-                permissions |= int(p)
+        lut = cls._PERM_LUT
+        permissions = 0
+        # Characters outside latin-1 can't be permission chars; just drop them
+        for c in pString.encode('latin-1', 'ignore'):
+            permissions |= lut[c]
         return permissions
 
     @classmethod
     def _permissionsIsRead(cls, permissions):
-        if permissions & cls._bmREAD:
-            return True
-        return False
+        return bool(permissions & cls._bmREAD)
 
     @classmethod
     def _permissionsIsWrite(cls, permissions):
-        if permissions & cls._bmWRITE:
-            return True
-        return False
+        return bool(permissions & cls._bmWRITE)
 
     @classmethod
     def _permissionsIsReadWrite(cls, permissions):
         bm = cls._bmWRITE | cls._bmREAD
-        if (permissions & bm) == bm:
-            return True
-        return False
+        return (permissions & bm) == bm
 
     def checkValidity(self):
         """Check for valid register description including the following potential errors:
@@ -591,8 +1008,8 @@ class Register():
         bits = 0
         bm = 0
         for member in self.members:
-            bm |= self.getMask(member)
-            bits += self.getWidth(member)
+            bm |= member.mask
+            bits += member.width
         if bm > ((1 << self._size) - 1):
             print("Invalid register definition {}: Bits are defined beyond the size of the register!".format(self._name))
             return False
@@ -603,50 +1020,88 @@ class Register():
         return True
 
     def reserveBits(self):
-        inReserved = False
-        rstart = 0
-        nBit = 0
-        for nbit in range(self._size):
-            nBit = nbit
-            # If nbit is in use
-            if self._isBitUsed(nbit):
-                if inReserved:
-                    # If inReserved, button up the reserved member
-                    self._addReservedMember(rstart, nbit)
-                    inReserved = False
-            else:
-                if not inReserved:
-                    rstart = nbit
-                    inReserved = True
-        if inReserved:
-            self._addReservedMember(rstart, nBit+1)
+        """Add a reserved member for each contiguous run of bits not used by any member."""
+        free = ~self._usedMask & ((1 << self._size) - 1)
+        while free:
+            lsb = free & -free              # Lowest bit of the next unused run
+            end = (free + lsb) & ~free      # The carry lands on the first used bit above the run
+            self._addReservedMember(lsb.bit_length() - 1, end.bit_length() - 1)
+            free &= ~(end - lsb)            # Clear the run
         return
 
     def sortMembers(self):
-        self.members.sort(key = lambda x : x[self._sOFFSET])
+        self.members.sort(key = lambda x : x.offset)
         return
 
+    def _buildMemberArrays(self):
+        """Cache the static attributes of all members (including reserved) as parallel
+        tuples in the order of self.members.  Must be called after the member list is
+        finalized."""
+        self._names = tuple(self.getName(member) for member in self.members)
+        self._offsets = tuple(self.getOffset(member) for member in self.members)
+        self._widths = tuple(self.getWidth(member) for member in self.members)
+        self._masks = tuple(member.mask for member in self.members)
+        self._perms = tuple(self.getPermissions(member) for member in self.members)
+        self._allMembers = tuple(self.members)
+        self._allMembersBE = self._allMembers[::-1]
+        self._userMembers = tuple(member for member in self.members if not member.reserved)
+        # (name, mask, offset, member) for all members and for the non-reserved members
+        self._memberCache = tuple(zip(self._names, self._masks, self._offsets, self.members))
+        self._userMemberCache = tuple(entry for entry in self._memberCache if not entry[3].reserved)
+        # Member lookup by name (the first member wins if names are repeated, e.g. reserved)
+        self._byName = {}
+        for member in self.members:
+            self._byName.setdefault(member.name, member)
+        # (name, shift, width mask) for each non-reserved member to decode a register value
+        members = self._userMembers
+        self._memberNames = tuple(self.getName(member) for member in members)
+        self._shifts = tuple(self.getOffset(member) for member in members)
+        widthMasks = tuple((1 << self.getWidth(member)) - 1 for member in members)
+        self._decoderTriples = tuple(zip(self._memberNames, self._shifts, widthMasks))
+        if (np is not None) and (len(members) >= _NUMPY_MIN_MEMBERS) and (self._size <= 64):
+            self._npShifts = np.array(self._shifts, dtype=np.uint64)
+            self._npMasks = np.array(widthMasks, dtype=np.uint64)
+        else:
+            self._npShifts = None
+            self._npMasks = None
+        # Member values (of all members) mirrored in a NumPy array so value() can be
+        # vectorized for registers with many members.  Only when every member has an int
+        # value and a unique name (the mirror is updated by name); otherwise value() sums
+        # the members in Python.
+        if ((np is not None) and (len(self.members) >= _NUMPY_MIN_MEMBERS) and (self._size <= 64)
+                and (len(set(self._names)) == len(self._names))
+                and all([isinstance(member.value, int) for member in self.members])):
+            self._valueArr = np.array([member.value & ((1 << member.width) - 1) for member in self.members],
+                                      dtype=np.uint64)
+            self._offsetArr = np.array(self._offsets, dtype=np.uint64)
+            self._maskArr = np.array(self._masks, dtype=np.uint64)
+            self._npIndex = {name: n for n, name in enumerate(self._names)}
+            self._npUserIdx = np.array([n for n, member in enumerate(self.members) if not member.reserved],
+                                       dtype=np.intp)
+        else:
+            self._valueArr = None
+
+    def _getUsedMask(self):
+        """Return the logical OR of the bitmasks of all non-reserved members."""
+        usedMask = 0
+        for member in self.members:
+            if not member.reserved:
+                usedMask |= member.mask
+        return usedMask
+
     def _isBitUsed(self, nBit):
-        for member in self.getMembers():
-            bm = self.getMask(member)
-            name = self.getName(member)
-            if bm & (1 << nBit):
-                return True
-        return False
+        return bool(self._usedMask & (1 << nBit))
 
     def _addReservedMember(self, nBitStart, nBitEnd):
         self.members.append(
-            {self._sNAME : self._RESERVED_PREFIXES[0],
-            self._sOFFSET : nBitStart,
-            self._sWIDTH : nBitEnd - nBitStart,
-            self._sPERMISSIONS : 0,
-            self._sVALUE : 0,
-            self._sDESC : ""}
-            )
+            _Member(self._RESERVED_PREFIXES[0], nBitStart, nBitEnd - nBitStart, 0, 0, "", reserved = True))
 
     @staticmethod
     def _binOnes(n, nbits = 32):
-        """Return the number of set bits (ones) in number 'n'"""
+        """Return the number of set bits (ones) in non-negative number 'n'.
+        'nbits' only limits the count on Python versions without int.bit_count()."""
+        if _HAS_BIT_COUNT:
+            return n.bit_count()
         x = 0
         for nbit in range(nbits):
             if n & (1 << nbit):
@@ -660,37 +1115,29 @@ class Register():
         if self._lock:
             # Prevent adding members after the class has been locked
             return
-        if width == None:
+        if width is None:
             width = 1   # default to 1 bit assumed width
         else:
             width = _int(width)
-        if offset == None:
+        if offset is None:
             offset = 0  # default to offset of 0
         else:
             offset = _int(offset)
-        if name == None:
+        if name is None:
             name = "R{:04x}".format(offset)     # Default name is e.g. "R000F" for register 15
         else:
             name = str(name)    # Input sanitization
         value = _int(value)
-        if value == None:
+        if value is None:
             value = 0
         #permissions = self._parsePermissionString(permissionString)
         # If any member is readable, the register is readable
-        isReadable = self._permissionsIsRead(permissions)
-        isWriteable = self._permissionsIsWrite(permissions)
-        if isReadable:
-            self._readable = True
-        if isWriteable:
-            self._writeable = True
-        self.members.append(
-            {self._sNAME : name,
-            self._sOFFSET : offset,
-            self._sWIDTH : width,
-            self._sPERMISSIONS : permissions,
-            self._sVALUE : value,
-            self._sDESC : description}
-            )
+        if self._permissionsIsRead(permissions):
+            self._flags |= self._fREADABLE
+        if self._permissionsIsWrite(permissions):
+            self._flags |= self._fWRITEABLE
+        self.members.append(_Member(name, offset, width, permissions, value, description,
+                                    reserved = self._isReserved(name)))
         return
 
     def _isReserved(self, name):
@@ -700,12 +1147,9 @@ class Register():
         return False
 
     def _bm(self, member):
-        """Return a bitmask for the given member in the register."""
-        offset = self.getOffset(member)
-        width = self.getWidth(member)
-        if (offset == None) or (width == None):
-            return None
-        return ((1 << width) - 1) << offset
+        """Return a bitmask for the given member in the register (computed once when
+        the member is created)."""
+        return member.mask
 
     def _bmString(self, member):
         bm = self._bm(member)
@@ -722,103 +1166,103 @@ class Register():
         #members = self.getAllMembers()
         s = ["Register {}".format(self.name())]
         for member in members:
-            width = self.getWidth(member)
-            offset = self.getOffset(member)
-            if width == 1:
-                bitString = "[{}]".format(offset)
-            else:
-                bitString = "[{}:{}]".format(offset + width - 1, offset)
-            s.append("  {} : {}".format(bitString, self.getName(member)))
+            s.append("  {} : {}".format(member.spanLabel, self.getName(member)))
         return "\n".join(s)
 
     def __str__(self):
         return self.__repr__()
 
     def isReserved(self, member):
-        name = self.getName(member)
-        return self._isReserved(name)
+        return member.reserved
 
     def isReadable(self):
-        return self._readable
+        return bool(self._flags & self._fREADABLE)
 
     def isWriteable(self):
-        return self._writeable
+        return bool(self._flags & self._fWRITEABLE)
 
     def printAll(self):
         members = self.getAllMembers()
         s = ["Register {}".format(self.name())]
         for member in members:
-            width = self.getWidth(member)
-            offset = self.getOffset(member)
-            if width == 1:
-                bitString = "[{}]".format(offset)
-            else:
-                bitString = "[{}:{}]".format(offset + width - 1, offset)
-            s.append("  {} : {}".format(bitString, self.getName(member)))
+            s.append("  {} : {}".format(member.spanLabel, self.getName(member)))
         print("\n".join(s))
         return
 
     def getMembers(self):
-        members = []
-        for member in self.members:
-            name = self.getName(member)
-            if not self._isReserved(name):
-                members.append(member)
-        return members
+        """Return the non-reserved members in order of offset as a tuple."""
+        return self._userMembers
+
+    def getMemberValues(self):
+        """Return a dict of {memberName : memberValue} pairs for all non-reserved
+        members, decoded from the current register value."""
+        regVal = self.value()
+        if self._npShifts is not None:
+            return dict(zip(self._memberNames, self.unpackAll(regVal).tolist()))
+        return {name: (regVal >> shift) & mask for name, shift, mask in self._decoderTriples}
+
+    def unpackAll(self, regValue):
+        """Decode register value 'regValue' into the values of all non-reserved members
+        (in the order of self._memberNames).  'regValue' may also be a 1-D sequence of
+        register values (e.g. a batch of reads of this register), in which case one row
+        of member values is returned per register value.
+        Returns a NumPy array for wide registers (if NumPy is available), otherwise a list."""
+        if self._npShifts is not None:
+            values = np.asarray(regValue, dtype=np.uint64)
+            return (values[..., np.newaxis] >> self._npShifts) & self._npMasks
+        if hasattr(regValue, '__len__'):
+            return [self.unpackAll(val) for val in regValue]
+        return [(regValue >> shift) & mask for name, shift, mask in self._decoderTriples]
 
     def getAllMembers(self):
-        members = self.members.copy()
-        return members
+        """Return all members (including reserved) in order of offset as a tuple."""
+        return self._allMembers
 
     def getAllMembersBigEndian(self):
-        members = self.members.copy()
-        members.reverse()
-        return members
+        """Return all members (including reserved) in reverse order of offset as a tuple."""
+        return self._allMembersBE
 
     def getMemberByName(self, name):
-        for member in self.members:
-            if name == member.get(self._sNAME, None):
-                return member
-        return None
+        return self._byName.get(name, None)
 
     def getName(self, member):
-        return member.get(self._sNAME, None)
+        return member.name
 
     def getWidthByName(self, name):
         member = self.getMemberByName(name)
-        if member != None:
-            return member.get(self._sWIDTH, None)
+        if member is not None:
+            return member.width
         return None
 
     def getWidth(self, member):
-        return member.get(self._sWIDTH, None)
+        return member.width
 
     def getOffsetByName(self, name):
         member = self.getMemberByName(name)
-        if member != None:
-            return member.get(self._sOFFSET, None)
+        if member is not None:
+            return member.offset
         return None
 
     def getOffset(self, member):
-        return member.get(self._sOFFSET, None)
+        return member.offset
 
     def getValueByName(self, name):
         member = self.getMemberByName(name)
-        if member != None:
-            return member.get(self._sVALUE, None)
+        if member is not None:
+            return member.value
         return None
 
     def getValue(self, member):
-        return member.get(self._sVALUE, None)
+        return member.value
 
     def getPermissionsByName(self, name):
         member = self.getMemberByName(name)
-        if member != None:
-            return member.get(self._sPERMISSIONS, None)
+        if member is not None:
+            return member.permissions
         return None
 
     def getPermissions(self, member):
-        return member.get(self._sPERMISSIONS, None)
+        return member.permissions
 
     def isMemberReadable(self, member):
         permissions = self.getPermissions(member)
@@ -830,41 +1274,49 @@ class Register():
 
     def getDescriptionByName(self, name):
         member = self.getMemberByName(name)
-        if member != None:
-            return member.get(self._sDESC, None)
+        if member is not None:
+            return member.desc
         return None
 
     def getDescription(self, member):
-        return member.get(self._sDESC, None)
+        return member.desc
+
+    def getSpanLabel(self, member):
+        """Return the bit span label of the member, e.g. "[3]" or "[7:4]"."""
+        return member.spanLabel
 
     def setMemberValue(self, member, value):
         name = self.getName(member)
-        if name != None:
+        if name is not None:
             # This member is in fact one of ours
             self.setMemberValueByName(name, value)
 
     def setMemberValueByName(self, name, value):
         """Set the value of a member by name (string)."""
-        # We have to do this carefully because we need to modify the stored dict, not a shallow copy
-        for n in range(len(self.members)):
-            memberName = self.getName(self.members[n])
-            if name == memberName:
-                self.members[n][self._sVALUE] = value
+        member = self._byName.get(name, None)
+        if member is None:
+            return
+        member.value = value
+        if self._valueArr is not None:
+            if isinstance(value, int):
+                self._valueArr[self._npIndex[name]] = value & ((1 << member.width) - 1)
+            else:
+                self._valueArr = None   # Can't be mirrored; use the Python path from now on
         # Check and clear the change dict if up-to-date
-        member = self.getMemberByName(name)
-        changeVal = self.changeDict.get(memberName, None)
-        if changeVal != None:
+        changeVal = self.changeDict.get(name, None)
+        if changeVal is not None:
             if value == changeVal:
                 # If the values are equal, remove the entry from the change dict
-                self.changeDict.pop(member)
+                # (which is keyed by member name, like everywhere else)
+                self.changeDict.pop(name)
 
     def getMask(self, member):
-        return self._bm(member)
+        return member.mask
 
     def getMaskByName(self, name):
-        member = self.getMemberByName(name)
-        if member != None:
-            return self._bm(member)
+        member = self._byName.get(name, None)
+        if member is not None:
+            return member.mask
         return None
 
     def get(self, s, fallback = None):
@@ -878,48 +1330,50 @@ class Register():
             return 0
 
     def isMember(self, name):
-        for member in self.getMembers():
-            memberName = self.getName(member)
-            if name == memberName:
-                return True
-        return False
+        """Return True if 'name' is the name of a (non-reserved) member."""
+        member = self._byName.get(name, None)
+        return (member is not None) and not member.reserved
 
     def set(self, regValue):
         """Receive a new register value (most likely from the device itself) and parse
         into member values."""
-        for member in self.getMembers():
-            mask = self.getMask(member)
-            offset = self.getOffset(member)
-            newval = (regValue & mask) >> offset
-            self.setMemberValue(member, newval)
+        # The change dict is reset below so member values can be set directly
+        for name, mask, offset, member in self._userMemberCache:
+            member.value = (regValue & mask) >> offset
+        if self._valueArr is not None:
+            idx = self._npUserIdx
+            regValue = np.uint64(regValue & 0xFFFFFFFFFFFFFFFF)
+            self._valueArr[idx] = (regValue & self._maskArr[idx]) >> self._offsetArr[idx]
         self.resetChanges()
 
     def setChange(self, regValue):
         """Set a new register value as a change (to be written to the device) and parse
         into the change dict."""
-        for member in self.getMembers():
-            name = self.getName(member)
-            mask = self.getMask(member)
-            offset = self.getOffset(member)
-            newval = (regValue & mask) >> offset
-            self.changeDict[name] = newval
+        changeDict = self.changeDict
+        for name, mask, offset, member in self._userMemberCache:
+            changeDict[name] = (regValue & mask) >> offset
 
     def setChangeDict(self, regDict):
+        byName = self._byName
+        changeDict = self.changeDict
         for memberName, value in regDict.items():
-            member = self.getMemberByName(memberName)
-            if member != None:
-                self.changeDict[memberName] = value
+            if memberName in byName:
+                changeDict[memberName] = value
 
     def setChangeDictIfChanged(self, regDict):
         currentValue = self.value()
         newValue = 0
+        touchedMask = 0     # Only the fields present in regDict are compared
         regAddr = self.addr()
+        getMember = self._byName.get
         for memberName, value in regDict.items():
-            member = self.getMemberByName(memberName)
-            mask = self.getMask(member)
-            offset = self.getOffset(member)
-            newValue |= (value << offset) & mask
-        if currentValue != newValue:
+            member = getMember(memberName, None)
+            if member is None:
+                continue
+            mask = member.mask
+            newValue |= (value << member.offset) & mask
+            touchedMask |= mask
+        if (currentValue ^ newValue) & touchedMask:
             print("Setting change value for register {} to value {}".format(regAddr, newValue))
             self.setChangeDict(regDict)
         else:
@@ -928,17 +1382,19 @@ class Register():
 
     def setByMembers(self, valDict):
         """Set register member values by a dict of {name : value} pairs."""
+        isMember = self.isMember
+        setMemberValueByName = self.setMemberValueByName
         for name, val in valDict.items():
-            if self.isMember(name):
-                self.setMemberValueByName(name, val)
+            if isMember(name):
+                setMemberValueByName(name, val)
 
     def setChangeByName(self, name, newValue):
-        members = self.getMembers()
-        member = members.get(name, None)
-        if member != None:
-            width = self.getWidth(member)
-            newValue = min(_int(newValue), (1 << width) - 1)    # Ensure newValue fits in the width
-            self.changeDict[member] = _int(newValue)
+        if not self.isMember(name):
+            return
+        member = self._byName[name]
+        width = self.getWidth(member)
+        newValue = min(_int(newValue), (1 << width) - 1)    # Ensure newValue fits in the width
+        self.changeDict[name] = newValue
 
     def isChanged(self):
         if len(self.changeDict) > 0:
@@ -959,30 +1415,34 @@ class Register():
 
     def nextValue(self):
         """Get the next value of the register (reflecting unsent member value changes)"""
+        if not self.changeDict:
+            return self.value()
         regVal = 0
-        for member in self.members: # Remember to get ALL the members, even the reserved ones
-            mask = self.getMask(member)
-            name = self.getName(member)
-            val = self.changeDict.get(name, None) # If the member is in the change dict, use that value
-            if val == None:
-                val = self.getValue(member)         # Otherwise use the last value
-            offset = self.getOffset(member)
+        # Remember to get ALL the members, even the reserved ones
+        getChange = self.changeDict.get
+        for name, mask, offset, member in self._memberCache:
+            val = getChange(name, None)         # If the member is in the change dict, use that value
+            if val is None:
+                val = member.value              # Otherwise use the last value
             regVal |= (val << offset) & mask
         return regVal
 
     def value(self):
         """Get the current value of the register as a whole."""
+        if self._valueArr is not None:
+            return int(np.bitwise_or.reduce((self._valueArr << self._offsetArr) & self._maskArr))
         regVal = 0
-        for member in self.members: # Remember to get ALL the members, even the reserved ones
-            mask = self.getMask(member)
-            val = self.getValue(member)
-            offset = self.getOffset(member)
-            regVal |= (val << offset) & mask
+        # Remember to get ALL the members, even the reserved ones
+        for name, mask, offset, member in self._memberCache:
+            regVal |= (member.value << offset) & mask
         return regVal
 
     def addr(self):
         return self._addr
 
+    def addrHex(self):
+        return self._addrHex
+
     def size(self):
         return self._size
 
@@ -1005,42 +1465,36 @@ class JSONRegisterMapReader():
     def load(self):
         if self._locked:
             return
-        if self.filename == None:
+        if self.filename is None:
             print("No filename provided")
             return False
         if not os.path.exists(self.filename):
             print("File {} does not seem to exist.".format(self.filename))
             return False
-        with open(self.filename, 'r') as fd:
-            self._jsonhack = JSONHack(self.filename)
-            self.jsondict = self._jsonhack.load()
-            print("Loaded {}".format(self.filename))
+        self._jsonhack = JSONHack(self.filename)
+        self.jsondict = self._jsonhack.load()
+        print("Loaded {}".format(self.filename))
 
     def interpret(self):
         if self._locked:
             return
         for key, val in self.jsondict.items():
             self.registers.append(self.parseRegister(key, val))
+        # Sort by address once here so the map (and GUI rows) are in address order
+        self.registers = tuple(sorted(self.registers, key = lambda register: register.addr()))
         print("Found {} registers.".format(len(self.registers)))
         self._locked = True
 
     def parseRegister(self, regName, valdict):
         name = regName
-        size = 0
-        addr = 0
-        permissions = 0
-        rmap = []
+        # Defaults for each recognized (lowercase) key; keys are case-insensitive
+        fields = {self._sSIZE : 0, self._sADDR : 0, self._sPERMISSIONS : 0, self._sMAP : []}
         for key, val in valdict.items():
             key = key.lower()
-            if key == self._sSIZE:
-                size = val
-            elif key == self._sADDR:
-                addr = val
-            elif key == self._sPERMISSIONS:
-                permissions = val
-            elif key == self._sMAP:
-                rmap = val
-        return self.makeRegister(name, addr, size, permissions, rmap)
+            if key in fields:
+                fields[key] = val
+        return self.makeRegister(name, fields[self._sADDR], fields[self._sSIZE],
+                                 fields[self._sPERMISSIONS], fields[self._sMAP])
 
     def makeRegister(self, name, addr, size, permissions, rmap):
         #print("Making register with name = {}, addr = {}, size = {}, permissions = {}".format(name, addr, size, permissions))
@@ -1054,7 +1508,7 @@ class JSONHack():
     The comments are ignored before the remainder of the file is passed to the JSON interpreter."""
     _commentChar = "#"
     def __init__(self, filename = None):
-        if filename == None:
+        if filename is None:
             filename = "default.json"
         self.filename = filename
         if not os.path.exists(self.filename):
@@ -1064,46 +1518,62 @@ class JSONHack():
         if not os.path.exists(self.filename):
             print("Cannot load. File {} doesn't appear to exist".format(self.filename))
             return {}
-        s = []
-        with open(self.filename, 'r') as fd:
-            line = True
-            while line:
-                #line = fd.readline().strip("\n") # severely undercounts lines...
-                line = fd.readline()
-                if line.strip().startswith(self._commentChar):
-                    # Skip any lines that begin with the comment char
-                    s.append("") # Append a blank line to ensure accurate line count on error
-                    continue
-                if len(line.strip('\n').replace('\r', '')) > 0:
-                    #print("len({}) = {}".format(line, len(line)))
-                    s.append(line.strip('\n'))
-                else:
-                    s.append("") # Append a blank line to ensure accurate line count on error
+        data = _readFileBytes(self.filename)
+        commentChar = self._commentChar.encode()
+        if commentChar in data:
+            # Blank out any lines that begin with the comment char (rather than removing
+            # them) to ensure accurate line count on error
+            data = b'\n'.join([b'' if line.lstrip().startswith(commentChar) else line
+                               for line in data.splitlines()])
         try:
-            o = json.loads('\n'.join(s))
-        except json.decoder.JSONDecodeError as jerr:
+            # Both json.loads() and orjson.loads() accept (utf-8) bytes directly
+            o = _json.loads(data)
+        except _json.JSONDecodeError as jerr:
             # This line number is not correct. Why?
             print("JSON Decoder Error:\n{}".format(jerr))
             o = {}
         return o
 
+def _readFileBytes(filename):
+    """Return the contents of file 'filename' as bytes.  The file is memory-mapped to
+    avoid the extra copy through the buffered file object; falls back to a plain read
+    where the file cannot be mapped (e.g. it is empty)."""
+    with open(filename, 'rb') as fd:
+        try:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+        except (ValueError, OSError):
+            return fd.read()
+
 def _int(s):
     """Do a better job at int() by allowing hex and binary strings."""
     # Pass ints right through
     if isinstance(s, int):
         return s
+    if isinstance(s, str):
+        # The same few strings are parsed over and over (e.g. by the GUI widgets)
+        return _intFromStringCached(s)
     if not hasattr(s, '__len__'):
         return s
-    base = 10
-    if 'x' in s:
-        base = 16
-    elif 'b' in s:
-        base = 2
+    return _intFromString(s)
+
+_HEX_PREFIXES = ('0x', '0X', '-0x', '-0X')
+_BIN_PREFIXES = ('0b', '0B', '-0b', '-0B')
+
+def _intFromString(s):
+    # Only the prefix decides the base (rather than searching the whole string)
     try:
-        n = int(s, base)
-    except:
+        s = s.strip()
+        base = 10
+        if s.startswith(_HEX_PREFIXES):
+            base = 16
+        elif s.startswith(_BIN_PREFIXES):
+            base = 2
+        return int(s, base)
+    except (TypeError, ValueError, AttributeError):
         return None
-    return n
+
+_intFromStringCached = functools.lru_cache(maxsize = 1024)(_intFromString)
 
 def readAndParseMemoryMap(argv):
     USAGE = "python3 {} memoryMapFileName".format(argv[0])
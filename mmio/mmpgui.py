@@ -21,6 +21,7 @@ qtc.Signal = qtc.pyqtSignal
 
 MAIN_TIMER_PERIOD = 0 # ms
 UPDATE_TIMER_PERIOD = 100 # ms
+IDLE_TIMEOUT = 500 # ms without traffic before the main timer is stopped
 
 class QtGUIRegMap(qtw.QMainWindow):
     def __init__(self, mmPeriph, mainTimerPeriod = MAIN_TIMER_PERIOD,
@@ -54,39 +55,47 @@ class QtGUIRegMap(qtw.QMainWindow):
 
     def initTimers(self):
         self.timerMain = qtc.QTimer()
+        self.timerMain.setTimerType(qtc.Qt.CoarseTimer)
         self.timerMain.timeout.connect(self.onTimerMain)
         self.timerMain.start(self._mainTimerPeriod)
         self.timerUpdate = qtc.QTimer()
+        self.timerUpdate.setTimerType(qtc.Qt.CoarseTimer)
         self.timerUpdate.timeout.connect(self.onTimerUpdate)
         self.timerUpdate.start(self._updateTimerPeriod)
+        # The main timer is stopped when idle and restarted when a command is queued
+        self._lastActivity = qtc.QElapsedTimer()
+        self._lastActivity.start()
+        self.mmPeriph.setCommandCallback(self.wakeMainTimer)
 
     def onTimerMain(self):
-        self.mmPeriph.processQueue()
-        self.mmPeriph.readAndParseFromDevice()
+        nSent = self.mmPeriph.processQueue()
+        received = self.mmPeriph.readAndParseFromDevice()
+        if nSent or received:
+            self._lastActivity.restart()
+        elif self.mmPeriph.queueEmpty() and self._lastActivity.hasExpired(IDLE_TIMEOUT):
+            # Nothing to send and nothing arriving (any responses would have by now)
+            self.timerMain.stop()
+
+    def wakeMainTimer(self):
+        """Restart the main timer (if stopped while idle)."""
+        self._lastActivity.restart()
+        if not self.timerMain.isActive():
+            self.timerMain.start(self._mainTimerPeriod)
 
     def onTimerUpdate(self):
         self.processUpdateRequests()
 
     def initUpdateRequests(self):
-        self._updateRequestList = []
+        # Used as an ordered set (keys only) so requests are issued in the order they were added
+        self._updateRequests = {}
 
     def addUpdateRequest(self, regAddr):
         """Add an update request for a particular register address."""
-        # Search for the address in the list
-        for lRegAddr in self._updateRequestList:
-            if regAddr == lRegAddr:
-                return  # If the address is already in the list, early return
-        # If we get here, we didn't find it in the list. Append it.
-        self._updateRequestList.append(regAddr)
+        self._updateRequests[regAddr] = None    # No-op if already requested
 
     def removeUpdateRequest(self, regAddr):
         """Remove an update request for a particular register address."""
-        # Search for the request in the list
-        for n in range(len(self._updateRequestList)):
-            lRegAddr = self._updateRequestList[n]
-            if regAddr == lRegAddr:
-                del self._updateRequestList[n] # If the request is found in the list, delete it
-                return # and early return
+        self._updateRequests.pop(regAddr, None)
 
     def onKeyboardUpdateOpenLoop(self):
         print("Open Loop")
@@ -110,12 +119,13 @@ class QtGUIRegMap(qtw.QMainWindow):
     def addRegister(self, gridLayout, row, register, gridWidth):
         addr = register.addr()
         self._widgets[addr] = []
-        labelAddr = qtw.QLabel(hex(addr))
+        labelAddr = qtw.QLabel(register.addrHex())
         gridLayout.addWidget(labelAddr, row, 0)       # First add the label
         if register.isReadable():
             checkBox = QtGUIRegisterCheckBox(addr)
             gridLayout.addWidget(checkBox, row, 1)    # Then add the check box if readable
             checkBox.toggled.connect(self.onRegisterChecked)
+        regFanout = []  # (setValue, shift, width mask) for each readable member widget
         for member in register.getAllMembersBigEndian():
             width = register.getWidth(member)
             offset = register.getOffset(member)
@@ -123,20 +133,23 @@ class QtGUIRegMap(qtw.QMainWindow):
             permissions = register.getPermissions(member)
             value = register.getValue(member)
             description = register.getDescription(member)
+            spanLabel = register.getSpanLabel(member)
             if register.isReserved(member):
-                widget = QtGUIWidgetReserved(width, offset)
+                widget = QtGUIWidgetReserved(width, offset, spanLabel = spanLabel)
             else:
                 if width == 1:
-                    widget = QtGUIWidgetBit(addr, name, width, offset, permissions, value, description = description)
+                    widget = QtGUIWidgetBit(addr, name, width, offset, permissions, value,
+                                            description = description, spanLabel = spanLabel)
                 else:
-                    widget = QtGUIWidgetInt(addr, name, width, offset, permissions, value, description = description)
+                    widget = QtGUIWidgetInt(addr, name, width, offset, permissions, value,
+                                            description = description, spanLabel = spanLabel)
                 # Only keep a reference to non-reserved widgets
                 self._widgets[addr].append(widget)
                 # Connect to widgets 'checked' signal for auto-updates  # CHANGE! Moving check boxes to register
                 #widget.checked.connect(self.onRegisterChecked)
                 if register.isMemberReadable(member):
-                    # If readable, register a SETTER
-                    self.mmPeriph.registerSetter(addr, name, widget.setValue)
+                    # If readable, the widget is updated by the register SETTER below
+                    regFanout.append((widget.setValue, offset, (1 << width) - 1))
                 if register.isMemberWriteable(member):
                     # If writeable, register a GETTER
                     self.mmPeriph.registerGetter(addr, name, widget.getValue)
@@ -145,6 +158,17 @@ class QtGUIRegMap(qtw.QMainWindow):
             gridLayout.addWidget(widget, row, column, 1, span)  # Row span = 0
         registerLabel = qtw.QLabel(register.name())
         gridLayout.addWidget(registerLabel, row, gridWidth - 1) # Row span = column span = 0
+        if len(regFanout) > 0:
+            self.mmPeriph.registerRegisterSetter(addr, self._makeRegisterSetter(tuple(regFanout)))
+
+    @staticmethod
+    def _makeRegisterSetter(fanout):
+        """Return a callback which distributes a whole register value to the member
+        widgets in 'fanout' (a sequence of (setValue, shift, width mask))."""
+        def setRegister(regValue):
+            for setValue, shift, mask in fanout:
+                setValue((regValue >> shift) & mask)
+        return setRegister
 
     def onRegisterChecked(self, info):
         regAddr, isChecked = info
@@ -156,15 +180,13 @@ class QtGUIRegMap(qtw.QMainWindow):
             self.removeUpdateRequest(regAddr)
 
     def processUpdateRequests(self):
-        for regAddr in self._updateRequestList:
-            self.mmPeriph.addReadToQueue(regAddr)
+        # Contiguous registers are read with one burst if the protocol supports it
+        if len(self._updateRequests) > 0:
+            self.mmPeriph.requestNewRegisterValues(list(self._updateRequests))
         #self.collectUpdateRequests()   # Only use this if the 'onWidgetChecked' signal method doesn't work
 
     def isAddressInUpdateList(self, regAddr):
-        if regAddr in self._updateRequestList:
-            return True
-        else:
-            return False
+        return regAddr in self._updateRequests
 
     def collectUpdateRequests(self):
         """Iterate through the gui widgets and add any 'checked' items to the list of registers
@@ -179,12 +201,12 @@ class QtGUIRegMap(qtw.QMainWindow):
 class QtGUIWidgetReserved(qtw.QWidget):
     _colorGray = "#AAAAAA"
     _bgColorGray = "#777777"
-    def __init__(self, width, offset):
+    def __init__(self, width, offset, spanLabel = None):
         super().__init__()
-        if width == 1:
-            bitString = "[{}]".format(offset)
+        if spanLabel is not None:
+            bitString = spanLabel
         else:
-            bitString = "[{}:{}]".format(offset + width - 1, offset)
+            bitString = QtGUIWidget._getSpanLabel(width, offset)
         self.regAddr = None
         self.name = None
         label = qtw.QLabel("{} Reserved".format(bitString))
@@ -214,35 +236,39 @@ class QtGUIRegisterCheckBox(qtw.QCheckBox):
 
 class QtGUIWidget(qtw.QWidget):
     checked = qtc.Signal(tuple)
-    def __init__(self, regAddr, name, width, offset, permissions, value = None, parent = None, description = None):
+    def __init__(self, regAddr, name, width, offset, permissions, value = None, parent = None, description = None,
+                 spanLabel = None):
         super().__init__(parent)
         self.parent = parent
         self.regAddr = regAddr
         self.name = name
         self.width = width
         self.offset = offset
-        self.spanLabel = self._getSpanLabel(self.width, self.offset)
-        if permissions != None:
+        if spanLabel is not None:
+            self.spanLabel = spanLabel  # Pre-formatted by the Register
+        else:
+            self.spanLabel = self._getSpanLabel(self.width, self.offset)
+        if permissions is not None:
             self.permissions = permissions
         else:
             self.permissions = 0
         self._readable = mmp.Register._permissionsIsRead(self.permissions)
         self._writeable = mmp.Register._permissionsIsWrite(self.permissions)
-        if value == None:
+        if value is None:
             self.value = 0
         else:
             value = _int(value)
-            if value == None:
+            if value is None:
                 self.value = 0
             else:
                 self.value = value
-        if description == None:
+        if description is None:
             self.description = self.name
         else:
             self.description = description
             self.setToolTip(self.description)
         self.create()
-        self.setValue(self.value)
+        self._displayValue()
 
     def onChecked(self):
         isChecked = self.checkBoxUpdate.isChecked()
@@ -300,11 +326,26 @@ class QtGUIWidget(qtw.QWidget):
 
     def setValue(self, value):
         intvalue = _int(value)
-        if intvalue != None:
-            self.value = intvalue
-            self.valueWidget.setText(hex(value))
-        else:
+        if intvalue is None:
             print("value {} yields None".format(value))
+            return
+        # Always rewritten: a user edit leaves the text out of step with self.value, and
+        # _setText already skips the redraw when nothing changed
+        self.value = intvalue
+        self._displayValue()
+
+    def _displayValue(self):
+        self._setText(hex(self.value))
+
+    def _setText(self, text):
+        """Programmatically update the value widget's text.  Skipped if the text is
+        unchanged (the common case when polling) to avoid a relayout/repaint, and the
+        widget's signals are blocked so it doesn't react to its own update."""
+        if self.valueWidget.text() == text:
+            return
+        blocker = qtc.QSignalBlocker(self.valueWidget)
+        self.valueWidget.setText(text)
+        blocker.unblock()
 
 class QtGUIWidgetInt(QtGUIWidget):
     def __init__(self, *args, **kwargs):
@@ -313,7 +354,7 @@ class QtGUIWidgetInt(QtGUIWidget):
 class QtGUIWidgetBit(QtGUIWidget):
     def __init__(self, *args, **kwargs):
         width = kwargs.get('width', None)
-        if width != None:
+        if width is not None:
             kwargs['width'] = 1 # Force all 'bit' types to be width 1
         super().__init__(*args, **kwargs)
 
@@ -337,34 +378,25 @@ class QtGUIWidgetBit(QtGUIWidget):
 
     def setValue(self, value):
         intvalue = _int(value)
-        if intvalue != None:
-            self.value = intvalue % 2
-            self.valueWidget.setText(str(self.value))
-        else:
+        if intvalue is None:
             print("value {} yields None".format(value))
+            return
+        intvalue %= 2
+        if intvalue == self.value:
+            return  # Nothing to redraw (the common case when polling)
+        self.value = intvalue
+        self._displayValue()
+
+    def _displayValue(self):
+        self._setText(str(self.value))
 
-def _int(s):
-    """Do a better job at int() by allowing hex and binary strings."""
-    # Pass ints right through
-    if isinstance(s, int):
-        return s
-    if not hasattr(s, '__len__'):
-        return s
-    base = 10
-    if 'x' in s:
-        base = 16
-    elif 'b' in s:
-        base = 2
-    try:
-        n = int(s, base)
-    except:
-        return None
-    return n
+# Share mmp's _int() (and its cache of parsed strings)
+_int = mmp._int
 
 class TestBox(qtw.QMainWindow):
     def __init__(self, dut = None, **kwargs):
         super().__init__(None)
-        if dut != None:
+        if dut is not None:
             self.dut = dut(**kwargs)
             self.setCentralWidget(self.dut)
             self.show()
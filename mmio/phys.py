@@ -2,8 +2,11 @@
 
 # PHY low-level device control classes for use with mmp.py and mmpgui.py
 
+import logging
 import serial
 
+log = logging.getLogger(__name__)
+
 class PHY():
     def __init__(self):
         pass
@@ -31,10 +34,14 @@ class PHY():
         return
 
 class PHY_USBUART(PHY):
+    RX_BUFFER_SIZE = 4096
     def __init__(self, port, baudrate=115200, timeout_ms = 1000):
         self.port = port
         self.baudrate = baudrate
         self.timeout_ms = timeout_ms
+        # Reused for every read rather than allocating a new buffer per poll
+        self._rxBuf = bytearray(self.RX_BUFFER_SIZE)
+        self._rxView = memoryview(self._rxBuf)
 
     def openDevice(self):
         try:
@@ -47,20 +54,20 @@ class PHY_USBUART(PHY):
         return self.com != None
 
     def readResponse(self, nBytes = 1):
-        inBytes = None
-        inWaiting = self.com.in_waiting
-        #if inWaiting >= nBytes:
-        if True:
-            try:
-                inBytes = self.com.read_all()
-                #print("readResponse() read {} bytes".format(len(inBytes)))
-            except Exception as e:
-                print("readResponse() Err\n" + e)
+        """Return the bytes already waiting (or None if there are none).  Never blocks;
+        a partial message is returned as-is and reassembled by the caller."""
+        try:
+            inWaiting = self.com.in_waiting
+            if inWaiting == 0:
                 return None
-        else:
-            #print("readResponse() inWaiting = {}".format(inWaiting))
+            # No more than is waiting, so the read never waits on the port timeout
+            nRead = self.com.readinto(self._rxView[:min(inWaiting, self.RX_BUFFER_SIZE)])
+            #print("readResponse() read {} bytes".format(nRead))
+        except Exception as e:
+            log.warning("readResponse() Err: %s", e)
             return None
-        return inBytes
+        # Copied out since the buffer is overwritten by the next read
+        return bytes(self._rxView[:nRead])
 
     def transmit(self, msg):
         if self.com.out_waiting > 0:
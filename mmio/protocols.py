@@ -3,12 +3,49 @@
 # Protocol classes for use with mmp.py and mmpgui.py
 
 import re
+import struct
+import logging
+import functools
+
+log = logging.getLogger(__name__)
 
 USE_CRC = False
 #USE_CRC = True
 
+# Validate response frames with a regex rather than fixed-offset slicing (slower;
+# useful when hunting malformed frames)
+STRICT_PARSE = False
+#STRICT_PARSE = True
+
 if USE_CRC:
     import crcmodel
+    # Prefer a SIMD (carryless-multiply) CRC library if one is installed, then the
+    # C-implemented crcmod; crcmodel is the pure-Python fallback
+    _crc16 = None
+    try:
+        import ctypes, ctypes.util
+        _libName = ctypes.util.find_library('crc_fast')
+        if _libName is not None:
+            _libcrc = ctypes.CDLL(_libName)
+            _libcrc.crc16_arc.argtypes = [ctypes.c_char_p, ctypes.c_size_t]
+            _libcrc.crc16_arc.restype = ctypes.c_uint16
+            _crc16 = lambda msg: _libcrc.crc16_arc(bytes(msg), len(msg))
+    except (ImportError, OSError, AttributeError):
+        _crc16 = None
+    if _crc16 is None:
+        try:
+            import crcmod.predefined
+            _crc16 = crcmod.predefined.mkCrcFun('crc-16')
+        except ImportError:
+            _crc16 = crcmodel.crc16
+else:
+    _crc16 = None
+
+@functools.lru_cache(maxsize = 1024)
+def _crcHex(msg):
+    """Return the CRC of bytes 'msg' as 4 hex characters.  Cached since the same
+    few messages (e.g. polling reads) are sent over and over."""
+    return b"%04x" % _crc16(msg)
 
 class Protocol():
     """This class should be inherited with the following methods overloaded
@@ -25,12 +62,36 @@ class Protocol():
             Unpack the raw response from the device into a register address and
             value.  The only response from a memory-mapped peripheral should be
             to a "read register" command.
+    Protocols which support burst (multi-register) transactions may also implement
+    the following optional methods.  If they are not defined, MMPeriph falls back
+    to one message per register.
+        packMessageWriteRegisters(startAddr, values)
+            Compose a bytes-type object to write the registers starting at address
+            'startAddr' with the values in sequence 'values'.
+        packMessageReadRegisters(startAddr, count)
+            Compose a bytes-type object to read 'count' registers starting at
+            address 'startAddr'.
+        unpackResponses(response)
+            Unpack a raw response which may hold several register values (e.g. the
+            reply to a burst read) into a list of (registerAddress, registerValue)
+            pairs.  Used instead of unpackResponse() if defined.
+        findTerminator(buf, start)
+            Return the index just past the first response terminator in 'buf' at or
+            after 'start', or None.  If defined, MMPeriph buffers received bytes and
+            only unpacks complete (terminated) responses.
     """
     @classmethod
     def responseBytes(cls):
         """Return the number of bytes expected in a response message."""
         return 1
 
+    @classmethod
+    def addressStride(cls):
+        """Return the address increment between adjacent registers (e.g. 4 for a
+        byte-addressed map of 32-bit registers).  Used to detect runs of contiguous
+        registers for burst transactions."""
+        return 1
+
     @classmethod
     def packMessageReadRegister(cls, addr):
         """Pack message bytes object for a register write command to be passed
@@ -51,20 +112,27 @@ class Protocol():
 
 class ProtocolIPCTRL_ASCII(Protocol):
     """Implements a limited set (just read-reg/write-reg) of the IPCTRL protocol
-    with ASCII character encoding."""
+    with ASCII character encoding.  Multiple reads can be pipelined (see
+    packBatchRead() and unpackResponses())."""
     CMD_CHAR_WRITE    = 'a'
     CMD_CHAR_READ     = 'b'
     CMD_CHAR_RESPONSE = 'c'
     TERMINATING_CHAR  = '\n'
     MIN_RESPONSE_LENGTH = 11
     _encoding = 'utf-8'
-    # '\A' matches the start of a string
-    _matchReadResponse = "\A" + CMD_CHAR_RESPONSE + "([0-9a-fA-F]{2})([0-9a-fA-F]{8})(.*)"
+    # '\A' matches the start of a string.  Bytes pattern, so raw responses match without decoding
+    _matchReadResponse = rb"\A" + CMD_CHAR_RESPONSE.encode(_encoding) + rb"([0-9a-fA-F]{2})([0-9a-fA-F]{8})(.*)"
     _reReadResponse = re.compile(_matchReadResponse)
-    if USE_CRC:
-        _CRCEng = crcmodel.cm_t(width = 16, poly = 0x8005, init = 0, refin = True, refot = True, xorot = 0)
-    else:
-        _CRCEng = None
+    _CRCFun = _crc16
+    # Pre-encoded message pieces
+    _CMD_WRITE_B = CMD_CHAR_WRITE.encode(_encoding)
+    _CMD_READ_B = CMD_CHAR_READ.encode(_encoding)
+    _RESPONSE_ORD = ord(CMD_CHAR_RESPONSE)
+    _TERM_B = TERMINATING_CHAR.encode(_encoding)
+    _HEX2 = tuple(b"%02x" % i for i in range(256))
+    _HEX_DIGITS = b"0123456789abcdefABCDEF"
+    # Inverse of _HEX2 (either case) for decoding the 2-char address field
+    _HEX2_LUT = {bytes((x, y)): int(bytes((x, y)), 16) for x in b"0123456789abcdefABCDEF" for y in b"0123456789abcdefABCDEF"}
 
     @classmethod
     def responseBytes(cls):
@@ -73,34 +141,56 @@ class ProtocolIPCTRL_ASCII(Protocol):
 
     @classmethod
     def _getCRC(cls, msg):
-        if cls._CRCEng == None:
-            return bytes(cls._hex4(0), cls._encoding)
-        cls._CRCEng.cm_ini()
-        for b in msg:
-            cls._CRCEng.cm_nxt(b)
-        crc = cls._CRCEng.cm_crc()
-        crc_hex = bytes(cls._hex4(crc), cls._encoding)
-        return crc_hex
+        if cls._CRCFun is None:
+            return b"0000"
+        if cls._CRCFun is _crc16:
+            return _crcHex(msg)
+        return b"%04x" % cls._CRCFun(msg)
 
     @classmethod
+    @functools.lru_cache(maxsize = 256)
     def packMessageReadRegister(cls, addr):
         """Pack message bytes object for a register write command to be passed
-        directly to the low-level PHY class."""
-        s = cls.CMD_CHAR_READ + cls._hex2(addr) + cls._hex8(0)
-        msg = bytes(s, cls._encoding)
-        crc = cls._getCRC(msg)
-        term = bytes(cls.TERMINATING_CHAR, cls._encoding)
-        return msg + crc + term
+        directly to the low-level PHY class.  Read messages depend only on 'addr'
+        so are cached."""
+        if not 0 <= addr <= 0xff:
+            log.warning("Register address %s out of range for a read", addr)
+            return None
+        msg = cls._CMD_READ_B + cls._HEX2[addr] + b"00000000"
+        return msg + cls._getCRC(msg) + cls._TERM_B
 
     @classmethod
     def packMessageWriteRegister(cls, addr, value):
         """Pack message bytes object for a register write command to be passed
         directly to the low-level PHY class."""
-        s = cls.CMD_CHAR_WRITE + cls._hex2(addr) + cls._hex8(value)
-        msg = bytes(s, cls._encoding)
-        crc = cls._getCRC(msg)
-        term = bytes(cls.TERMINATING_CHAR, cls._encoding)
-        return msg + crc + term
+        if not 0 <= addr <= 0xff:
+            log.warning("Register address %s out of range for a write", addr)
+            return None
+        msg = cls._CMD_WRITE_B + cls._HEX2[addr] + b"%08x" % value
+        return msg + cls._getCRC(msg) + cls._TERM_B
+
+    @classmethod
+    def packBatchRead(cls, addrs):
+        """Pack read commands for each address in 'addrs' into one bytes object so they
+        can be sent in a single transfer (the device replies with one response each)."""
+        msgs = [cls.packMessageReadRegister(addr) for addr in addrs]
+        if None in msgs:
+            return None
+        return b"".join(msgs)
+
+    @classmethod
+    def packMessageReadRegisters(cls, startAddr, count):
+        """Pack read commands for 'count' consecutive registers starting at 'startAddr'.
+        IPCTRL has no burst read, so this pipelines one read command per register."""
+        return cls.packBatchRead(range(startAddr, startAddr + count))
+
+    @classmethod
+    def unpackResponses(cls, response):
+        """Split a buffer holding any number of terminated responses and unpack each.
+        Returns a list of (registerAddress, registerValue) pairs."""
+        if isinstance(response, str):
+            response = response.encode(cls._encoding)
+        return [cls.unpackResponse(frame) for frame in bytes(response).split(cls._TERM_B) if frame]
 
     @classmethod
     def unpackResponse(cls, response):
@@ -109,15 +199,29 @@ class ProtocolIPCTRL_ASCII(Protocol):
         #print("Unpacking {} bytes = {}".format(len(response), response))
         if len(response) < cls.MIN_RESPONSE_LENGTH:
             return (None, None)
-        if hasattr(response, 'decode'):
-            response = response.decode(cls._encoding)
-        match = cls._reReadResponse.match(response)
-        if not match:
+        if type(response) is not bytes:
+            if isinstance(response, str):
+                response = response.encode(cls._encoding)
+            else:
+                response = bytes(response)
+        if STRICT_PARSE:
+            match = cls._reReadResponse.match(response)
+            if not match:
+                return (None, None)
+            nreg = cls._HEX2_LUT[match.group(1)]
+            regval = int(match.group(2), 16)
+            return (nreg, regval)
+        # Fixed layout: response char, 2 hex chars of address, 8 hex chars of value
+        if response[0] != cls._RESPONSE_ORD:
+            return (None, None)
+        nreg = cls._HEX2_LUT.get(response[1:3])
+        if nreg is None:
+            return (None, None)
+        field = response[3:11]
+        # int() alone would also accept a sign or whitespace (e.g. line noise giving -1)
+        if len(field) != 8 or field.translate(None, cls._HEX_DIGITS):
             return (None, None)
-        #nregString = match.group(1)
-        #regvalString = match.group(2)
-        nreg = cls._fromHex(match.group(1))
-        regval = cls._fromHex(match.group(2))
+        regval = int(field, 16)
         #print("Parsed: {}, {}".format(nreg, regval))
         return (nreg, regval)
 
@@ -134,11 +238,13 @@ class ProtocolIPCTRL_ASCII(Protocol):
             return False
 
     @classmethod
-    def _isBufferTerminated(cls, b):
-        for i in b:
-            if cls.isTerminated(i):
-                return True
-        return False
+    def findTerminator(cls, buf, start = 0):
+        """Return the index just past the first terminator in 'buf' at or after 'start',
+        or None if there isn't one."""
+        i = buf.find(cls._TERM_B, start)
+        if i < 0:
+            return None
+        return i + len(cls._TERM_B)
 
     @staticmethod
     def _fromHex(h):
@@ -148,17 +254,17 @@ class ProtocolIPCTRL_ASCII(Protocol):
     @staticmethod
     def _hex8(b):
         """Returns a string of 8 chars of 'b' in hex-base (0-padded to the left)"""
-        return "{:08x}".format(b)
+        return "%08x" % b
 
     @staticmethod
     def _hex4(b):
         """Returns a string of 4 chars of 'b' in hex-base (0-padded to the left)"""
-        return "{:04x}".format(b)
+        return "%04x" % b
 
     @staticmethod
     def _hex2(b):
         """Returns a string of 2 chars of 'b' in hex-base (0-padded to the left)"""
-        return "{:02x}".format(b)
+        return "%02x" % b
 
     @classmethod
     def testPackMessageReadRegister(cls, argv):
@@ -196,6 +302,77 @@ class ProtocolIPCTRL_ASCII(Protocol):
         print("nreg = {}, regval = {}".format(nreg, regval))
         return True
 
+class ProtocolIPCTRL_BIN(Protocol):
+    """Binary variant of ProtocolIPCTRL_ASCII (read-reg/write-reg only) which skips the
+    hex encoding.  Each message (command or response) is a fixed 8-byte frame:
+        cmd (1 byte) | addr (1 byte) | value (4 bytes, big-endian) | CRC (2 bytes, big-endian)
+    The CRC covers the first 6 bytes and is 0 if USE_CRC is False."""
+    CMD_WRITE    = ord('a')
+    CMD_READ     = ord('b')
+    CMD_RESPONSE = ord('c')
+    _FMT = struct.Struct('>BBI')
+    _CRC = struct.Struct('>H')
+    FRAME_LENGTH = _FMT.size + _CRC.size
+    _CRCFun = _crc16
+
+    @classmethod
+    def responseBytes(cls):
+        """Return the number of bytes expected in a response message."""
+        return cls.FRAME_LENGTH
+
+    @classmethod
+    def _frame(cls, cmd, addr, value):
+        body = cls._FMT.pack(cmd, addr, value)
+        if cls._CRCFun is None:
+            return body + b"\x00\x00"
+        return body + cls._CRC.pack(cls._CRCFun(body))
+
+    @classmethod
+    @functools.lru_cache(maxsize = 256)
+    def packMessageReadRegister(cls, addr):
+        """Pack message bytes object for a register read command to be passed
+        directly to the low-level PHY class."""
+        return cls._frame(cls.CMD_READ, addr, 0)
+
+    @classmethod
+    def packMessageWriteRegister(cls, addr, value):
+        """Pack message bytes object for a register write command to be passed
+        directly to the low-level PHY class."""
+        return cls._frame(cls.CMD_WRITE, addr, value)
+
+    @classmethod
+    def packMessageReadRegisters(cls, startAddr, count):
+        """Pack (pipelined) read commands for 'count' consecutive registers starting
+        at 'startAddr'."""
+        return b"".join([cls.packMessageReadRegister(addr) for addr in range(startAddr, startAddr + count)])
+
+    @classmethod
+    def unpackResponse(cls, response):
+        """Unpack a response read directly from the low-level PHY class.
+        Interpret response into (registerAddress, registerValue) and return."""
+        if len(response) < cls.FRAME_LENGTH:
+            return (None, None)
+        cmd, nreg, regval = cls._FMT.unpack_from(response)
+        if cmd != cls.CMD_RESPONSE:
+            return (None, None)
+        return (nreg, regval)
+
+    @classmethod
+    def unpackResponses(cls, response):
+        """Unpack a buffer of any number of whole response frames into a list of
+        (registerAddress, registerValue) pairs."""
+        flen = cls.FRAME_LENGTH
+        return [cls.unpackResponse(response[n:n + flen]) for n in range(0, len(response) - flen + 1, flen)]
+
+    @classmethod
+    def findTerminator(cls, buf, start = 0):
+        """Frames are fixed-length, so return the end of the frame containing index
+        'start' (counting from the start of 'buf') if that frame is complete, else None."""
+        end = (start // cls.FRAME_LENGTH + 1) * cls.FRAME_LENGTH
+        if end > len(buf):
+            return None
+        return end
+
 if __name__ == "__main__":
     import sys
     #ProtocolIPCTRL_ASCII.testUnpackResponse(sys.argv)
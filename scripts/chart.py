@@ -4,8 +4,13 @@
 Channels are accessed/referenced by label or index and each window of values has a
 FIFO-style interface."""
 
+import math
+import numbers
+import logging
 import fifo
 
+log = logging.getLogger(__name__)
+
 class ChartRecorder():
     """A container for a number of channels, each with a moving window of 'depth' values.
     Channels are accessed/referenced by label or index and each window of values has a
@@ -13,10 +18,16 @@ class ChartRecorder():
     DEPTH_DEFAULT = 8
     _indexLabel = 0
     _indexFifo = 1
-    def __init__(self, depth = DEPTH_DEFAULT):
+    _indexSums = 2      # [running sum of integer values, count of non-numeric values,
+                        #  count of non-integer (e.g. float) values]
+    def __init__(self, depth = DEPTH_DEFAULT, numeric = False):
+        """If 'numeric' is True (and numpy is available), channels only hold numbers
+        and are stored in numpy arrays (see fifo.NpFifo)."""
         self.index = 0
         self.depth = depth
+        self.numeric = numeric and (fifo.np is not None)
         self._channelFifos = []
+        self._byLabel = {}      # label: index
 
     @staticmethod
     def _isString(s):
@@ -34,28 +45,40 @@ class ChartRecorder():
             return self._getFifoByLabel(ref)
         return self._getFifoByIndex(ref)
 
+    def _getChannel(self, ref):
+        """Return the (label, fifo, sums) entry for reference 'ref' (label or index)."""
+        if self._isString(ref):
+            try:
+                return self._channelFifos[self._byLabel[ref]]
+            except KeyError:
+                log.warning("Could not find FIFO with label %s", ref)
+                return None
+        if ref > len(self._channelFifos) - 1:
+            log.warning("Index %s out of range %d", ref, len(self._channelFifos))
+            return None
+        return self._channelFifos[ref]
+
     def _getFifoByIndex(self, index):
         if index > len(self._channelFifos) - 1:
-            print("Index {} out of range {}".format(index, len(self._channelFifos)))
+            log.warning("Index %s out of range %d", index, len(self._channelFifos))
             return None
         return self._channelFifos[index][self._indexFifo]
 
     def _getFifoByLabel(self, label):
-        for fLabel, fifo in self._channelFifos:
-            if label == fLabel:
-                return fifo
-        print("Could not find FIFO with label {}".format(label))
-        return None
+        try:
+            return self._channelFifos[self._byLabel[label]][self._indexFifo]
+        except KeyError:
+            log.warning("Could not find FIFO with label %s", label)
+            return None
 
     def _getLabel(self, ref):
         if self._isString(ref):
-            for fLabel, fifo in self._channelFifos:
-                if ref == fLabel:
-                    return fLabel
-            print("Could not find FIFO with label {}".format(label))
+            if ref in self._byLabel:
+                return ref
+            log.warning("Could not find FIFO with label %s", ref)
             return None
         if ref > len(self._channelFifos) - 1:
-            print("Index {} out of range {}".format(ref, len(self._channelFifos)))
+            log.warning("Index %s out of range %d", ref, len(self._channelFifos))
             return
         return self._channelFifos[ref][self._indexLabel]
 
@@ -65,28 +88,29 @@ class ChartRecorder():
         return
 
     def addChannel(self, label = None):
-        for n in range(len(self._channelFifos)):
-            fLabel = self._channelFifos[n][self._indexLabel]
-            if fLabel == label:
-                print("Channel with label {} already exists at index {}".format(label, n))
-                return None
-        chanFifo = fifo.FIFO(self.depth, blockOnFull = False)
+        if label in self._byLabel:
+            print("Channel with label {} already exists at index {}".format(label, self._byLabel[label]))
+            return None
+        if self.numeric:
+            chanFifo = fifo.NpFifo(self.depth, blockOnFull = False)
+        else:
+            chanFifo = fifo.FIFO(self.depth, blockOnFull = False)
         index = self.index
         if label == None:
             label = self._getDefaultLabel(index)
-        self._channelFifos.append((label, chanFifo))
+        self._channelFifos.append((label, chanFifo, [0, 0, 0]))
+        self._byLabel.setdefault(label, index)
         self.index += 1
         return index
 
     def getIndex(self, label = None):
         if label == None:
             return None
-        for n in range(len(self._channelFifos)):
-            fLabel = self._channelFifos[n][self._indexLabel]
-            if label == fLabel:
-                return n
-        print("getIndex(): Could not find label {}".format(label))
-        return None
+        try:
+            return self._byLabel[label]
+        except KeyError:
+            print("getIndex(): Could not find label {}".format(label))
+            return None
 
     def __len__(self):
         return self.index
@@ -94,36 +118,60 @@ class ChartRecorder():
     def addValue(self, ref, val):
         """Add value 'val' to channel associated with reference 'ref' which can be either
         a label or an index."""
-        fifo = self._getFifo(ref)
-        if fifo != None:
-            fifo.add(val)
-            return True
-        return False
+        chan = self._getChannel(ref)
+        if chan is None:
+            return False
+        if self.numeric:
+            # Convert first so a bad value is turned away before the window or sums change
+            try:
+                val = float(val)
+            except (TypeError, ValueError):
+                log.warning("Channel %s only holds numbers; ignoring %r", ref, val)
+                return False
+        fifo = chan[self._indexFifo]
+        sums = chan[self._indexSums]
+        if fifo.isFull():
+            # The oldest value is about to be displaced; take it out of the running sum
+            self._accumulate(sums, fifo[0], -1)
+        fifo.add(val)
+        self._accumulate(sums, val, 1)
+        return True
+
+    @staticmethod
+    def _accumulate(sums, val, sign):
+        # Only integers are summed as they go (exactly); a running float sum loses precision
+        # as values leave the window and never recovers from a nan/inf
+        if isinstance(val, numbers.Integral):
+            sums[0] += sign*val
+        elif isinstance(val, numbers.Number):
+            sums[2] += sign
+        else:
+            sums[1] += sign
 
     def getAvg(self, ref):
         """Get the average of all values stored in FIFO associated with reference 'ref' (label
         or index).  Returns None if values could not be averaged (e.g. if non-numeric)."""
-        fifo = self._getFifo(ref)
-        if fifo == None:
-            print("getAvg() could not find FIFO from reference {}".format(ref))
+        chan = self._getChannel(ref)
+        if chan is None:
+            log.warning("getAvg() could not find FIFO from reference %s", ref)
             return None
-        nVals = len(fifo)   # Returns the number of items stored in the fifo
+        chanFifo = chan[self._indexFifo]
+        nVals = len(chanFifo)   # The number of items stored in the fifo
         if nVals == 0:
-            print("FIFO associated with {} is empty".format(ref))
+            log.warning("FIFO associated with %s is empty", ref)
             return None
-        vsum = 0
-        fault = False
-        m = 0
-        for n in range(nVals):
-            try:
-                vsum += fifo[n]
-            except:
-                fault = True
-                break
-        if fault:
-            m = n
-            print("Could not compute average with value {}".format(fifo[n]))
+        vsum, nonNumeric, inexact = chan[self._indexSums]
+        if nonNumeric:
+            log.warning("Could not compute average of non-numeric values in %s", ref)
             return None
+        if self.numeric:
+            return float(chanFifo.mean())
+        if inexact:
+            # Summed over the window each time (exactly rounded) rather than kept running
+            try:
+                return math.fsum(chanFifo)/nVals
+            except TypeError:   # e.g. complex values
+                return sum(chanFifo)/nVals
         return vsum/nVals
 
     def getLatest(self, ref):
@@ -140,10 +188,11 @@ class ChartRecorder():
         label = self._getLabel(ref)
         avg = self.getAvg(ref)
         latest = self.getLatest(ref)
-        vals = []
-        for n in range(len(fifo)):
-            vals.append(fifo[n])
-        print("Channel {}. Vals = {}. Latest = {}. Average = {:.3f}".format(label, vals, latest, avg))
+        vals = fifo.snapshot()
+        if avg is None:
+            print("Channel {}. Vals = {}. Latest = {}.".format(label, vals, latest))
+        else:
+            print("Channel {}. Vals = {}. Latest = {}. Average = {:.3f}".format(label, vals, latest, avg))
         return
 
 def testChartRecorder(argv):
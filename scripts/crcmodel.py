@@ -13,10 +13,19 @@
 #   XorOut : 0000
 #   Check  : BB3D
 
+import logging
+
+log = logging.getLogger(__name__)
+
 def _bin8(h):
     return "{:08b}".format(h)
 
+# Bit-reversed value of each byte
+_REFL8 = bytes(int(_bin8(i)[::-1], 2) for i in range(256))
+
 class cm_t():
+    __slots__ = ('width', 'poly', 'init', 'refin', 'refot', 'xorot', 'reg', '_ready',
+                 '_table', '_mask', '_topbit', '_topshift')
     def __init__(self, width = None, poly = None, init = None, refin = False, refot = False, xorot = False):
         self.width = width
         self.poly = poly
@@ -26,12 +35,23 @@ class cm_t():
         self.xorot = xorot
         self.reg = 0
         self._ready = False
+        self._table = None
         if self._check():
             self._ready = True
+            self._build()
             self.cm_ini()
         else:
             print("cm_t not initialized!")
 
+    def _build(self):
+        """Precompute the byte-wise (Sarwate) lookup table.  For reflected input the
+        table and register are kept reflected so the register shifts right."""
+        self._mask = self._widmask()
+        self._topbit = 1 << (self.width - 1)
+        self._topshift = self.width - 8
+        tab = cm_tab(self)
+        self._table = [tab.calc(i) for i in range(256)]
+
     def _check(self):
         if self.width is None:
             return False
@@ -60,52 +80,63 @@ class cm_t():
             self.refot = refot
         if xorot is not None:
             self.xorot = xorot
+        if self._check():
+            self._ready = True
+            self._build()
+            self.cm_ini()
         return
 
     def cm_ini(self):
-        self.reg = self.init
+        if self.refin:
+            self.reg = self._reflect(self.init, self.width)
+        else:
+            self.reg = self.init
 
     def cm_nxt(self, ch):
         if self._ready:
-            topbit = (1 << (self.width - 1))    # Bitmask of top bit of poly width
             if self.refin:
-                ch = self._reflect(ch, 8)
-            self.reg ^= (ch << (self.width - 8))
-            for i in range(8):
-                if (self.reg & topbit):         # If the MSbit of the register is '1'
-                    self.reg = (self.reg << 1) ^ self.poly
-                else:
-                    self.reg <<= 1
-                self.reg &= self._widmask()
+                self.reg = (self.reg >> 8) ^ self._table[(self.reg ^ ch) & 0xFF]
+            else:
+                self.reg = ((self.reg << 8) ^ self._table[((self.reg >> self._topshift) ^ ch) & 0xFF]) & self._mask
         return
 
     def cm_crc(self):
         if self._ready:
-            if self.refot:
+            # The register is held reflected when refin is set
+            if self.refot != self.refin:
                 return self.xorot ^ self._reflect(self.reg, self.width)
             else:
                 return self.xorot ^ self.reg
         else:
-            print("cm_crc - not initialized!")
+            log.warning("cm_crc - not initialized!")
 
     def cm_blk(self, blk):
         if self._ready:
-            for b in blk:
-                self.cm_nxt(b)
+            table = self._table
+            reg = self.reg
+            if self.refin:
+                for b in blk:
+                    reg = (reg >> 8) ^ table[(reg ^ b) & 0xFF]
+            else:
+                topshift = self._topshift
+                mask = self._mask
+                for b in blk:
+                    reg = ((reg << 8) ^ table[((reg >> topshift) ^ b) & 0xFF]) & mask
+            self.reg = reg
         else:
-            print("cm_blk - not initialized!")
+            log.warning("cm_blk - not initialized!")
 
     @staticmethod
     def _reflect(val, bottom):
         """Returns the value 'val' with the bottom 'bottom' = [0-32] bits reflected"""
+        nbytes = (bottom + 7) >> 3
         t = val
-        for i in range(bottom):
-            if (t & 1):
-                val |= (1 << (bottom - 1 - i))
-            else:
-                val &= ~(1 << (bottom - 1 - i))
-            t >>= 1
-        return val
+        r = 0
+        for i in range(nbytes):
+            r = (r << 8) | _REFL8[t & 0xFF]
+            t >>= 8
+        r >>= (nbytes << 3) - bottom
+        return (val & ~((1 << bottom) - 1)) | r
 
     def _widmask(self):
         return (((1 << (self.width - 1)) - 1) << 1) | 1
@@ -124,19 +155,32 @@ class cm_tab():
             print("cm not initialized")
 
     def calc(self, index):
-        topbit = (1 << (self.width - 1))    # Bitmask of top bit of poly width
+        width = self.width
+        poly = self.poly
+        topbit = (1 << (width - 1))    # Bitmask of top bit of poly width
         if self.refin:
-            index = cm_t._reflect(index, 8)
-        r = index << (self.width - 8)
+            index = _REFL8[index]
+        r = index << (width - 8)
         for i in range(8):
             if (r & topbit):
-                r = (r << 1) ^ self.poly
+                r = (r << 1) ^ poly
             else:
                 r <<= 1
         if self.refin:
-            r = cm_t._reflect(r, self.width)
+            r = cm_t._reflect(r, width)
         return r & self.cm._widmask()
 
+# Table for the "CRC-16" (ARC) parameters described at the top of this file
+_CRC16_TABLE = tuple(cm_t(width = 16, poly = 0x8005, init = 0, refin = True, refot = True, xorot = 0)._table)
+
+def crc16(msg, _t = _CRC16_TABLE):
+    """Return the CRC-16 (ARC) of bytes-like 'msg'.  Unlike cm_t, this keeps no
+    state between calls so is safe to share between threads."""
+    reg = 0
+    for b in msg:
+        reg = (reg >> 8) ^ _t[(reg ^ b) & 0xFF]
+    return reg
+
 def main():
     cm16 = cm_t(
         width = 16,
@@ -153,6 +197,7 @@ def main():
     crc = cm16.cm_crc()
     print("msg = {}".format(msg.decode('ASCII')))
     print("CRC = {:04x}".format(crc))
+    print("crc16() = {:04x}".format(crc16(msg)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,7 +6,16 @@
 #   Indexes go oldest-to-newest (i.e. 0 is the least-recently added item, -1 is the most-recently added)
 # * len(fifo) returns the number of items pending in the fifo
 
+import collections
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 class FIFO(object):
+    __slots__ = ('_depth', '_blockOnFull', '_buffer', 'add')
     def __init__(self, bufferDepth = 3, blockOnFull = True):
         """A simple FIFO implementation.
         bufferDepth = the number of items the buffer can hold
@@ -15,59 +24,54 @@ class FIFO(object):
             if True: adds to a full buffer are rejected (returns False, item not added)"""
         self._depth = int(bufferDepth)
         self._blockOnFull = blockOnFull
-        self._buffer = [None]*self._depth
-        self._addPtr = 0
-        self._getPtr = 0
-        self._empty = True
-
-    def _incGetPtr(self):
-        self._getPtr = (self._getPtr + 1) % self._depth
-
-    def _incAddPtr(self):
-        self._addPtr = (self._addPtr + 1) % self._depth
+        # A deque with maxlen drops its oldest item when appending to a full buffer
+        self._buffer = collections.deque(maxlen = self._depth)
+        # add(item) is chosen once here since blockOnFull never changes
+        self.add = self._addBlocking if blockOnFull else self._addShifting
 
     def reset(self):
-        self._addPtr = 0
-        self._getPtr = 0
-        self._empty = True
+        self._buffer.clear()
+
+    def _addBlocking(self, item):
+        """Add an item to the buffer (blocking buffer).
+        if full, returns False
+        else, returns True"""
+        buf = self._buffer
+        if len(buf) == self._depth:
+            return False
+        buf.append(item)
+        return True
 
-    def add(self, item):
-        """Add an item to the buffer.
-        Blocking Buffer:
-            if full, returns False
-            else, returns True
-        Non-blocking Buffer:
-            always returns True
-            if Full, the next item to 'get' will be forgotten (garbage-collected)"""
-        # Check for full
-        if self.isFull():
-            if self._blockOnFull:
+    def _addShifting(self, item):
+        """Add an item to the buffer (non-blocking buffer).
+        always returns True
+        if Full, the next item to 'get' will be forgotten (garbage-collected)"""
+        self._buffer.append(item)
+        return True
+
+    def addMany(self, items):
+        """Add each item of iterable 'items' in order, as repeated add() calls would.
+        Returns True if all items were added, or False if a blocking buffer filled up
+        (the items which fit are added; the rest are not)."""
+        if self._blockOnFull:
+            it = iter(items)
+            self._extend(itertools.islice(it, self._depth - len(self._buffer)))
+            for _ in it:
                 return False
-            else:
-                # Increment (wrap) get pointer to 'forget' last item
-                self._incGetPtr()
-        self._buffer[self._addPtr] = item
-        # Increment (wrap if necessary) add pointer
-        self._incAddPtr()
-        # It is now not empty
-        self._empty = False
+            return True
+        self._extend(items)
         return True
 
+    def _extend(self, items):
+        self._buffer.extend(items)
+
     def get(self):
         """Get the next item in the buffer.
         If empty, returns None
         Else, returns the item"""
-        # Check for empty
-        if self.isEmpty():
-            return None
-        # Fetch the item to return
-        item = self._buffer[self._getPtr]
-        # Increment (wrap if necessary) get pointer
-        self._incGetPtr()
-        # Now if pointers are equal, we must be empty
-        if self._addPtr == self._getPtr:
-            self._empty = True
-        return item
+        if self._buffer:
+            return self._buffer.popleft()
+        return None
 
     def load(self):
         """Get the next item in the buffer without
@@ -76,51 +80,41 @@ class FIFO(object):
         in the queue.
         If empty, returns None
         Else, returns the item"""
-        # Check for empty
-        if self.isEmpty():
-            return None
-        # Fetch the item to return
-        item = self._buffer[self._getPtr]
-        return item
+        if self._buffer:
+            return self._buffer[0]
+        return None
 
     def inc(self):
         """Increment the buffer (forget the next item).
         This should be used with load() to perform a two-stage
         'get' operation which gives you a chance to leave the
         item in the buffer for a future retry of processing."""
-        # Check for empty
-        if self.isEmpty():
-            return None
-        # Increment (wrap if necessary) get pointer
-        self._incGetPtr()
-        # Now if pointers are equal, we must be empty
-        if self._addPtr == self._getPtr:
-            self._empty = True
+        if self._buffer:
+            self._buffer.popleft()
         return
 
     def isFull(self):
         """Return True if the buffer is full, else return False."""
-        return (not self._empty) and (self._addPtr == self._getPtr)
+        return len(self._buffer) == self._depth
 
     def isEmpty(self):
         """Return True if the buffer is empty, else return False."""
-        return self._empty
+        return not self._buffer
 
     def getNumItems(self):
         """Get the number of items currently in the buffer.  Will always
         return a number between 0 and bufferDepth"""
-        if self.isFull():
-            return self._depth
-        else:
-            return (self._addPtr + self._depth - self._getPtr) % self._depth
+        return len(self._buffer)
 
     def __len__(self):
-        return self.getNumItems()
+        return len(self._buffer)
+
+    def __iter__(self):
+        """Iterate over the stored items in index order (without removing them)."""
+        return iter(self._buffer)
 
     def __getitem__(self, index):
-        index = self._convertGetIndex(index)
-        if index == None:
-            return None
+        # deque does the negative-index conversion and bounds check itself (in C)
         return self._buffer[index]
 
     def __setitem__(self, key, value):
@@ -129,152 +123,194 @@ class FIFO(object):
             key = int(key)
         except ValueError:
             raise TypeError("Buffer index must be an integer")
-        #print("key = {}".format(key))
-        index = self._convertSetIndex(key)
-        #print("index = {}".format(index))
-        if index == None:
-            return False
-        self._buffer[index] = value
-        return True
+        self._buffer[self._convertSetIndex(key)] = value
 
     def _convertGetIndex(self, index):
+        """Return the buffer position of item 'index' (negative counts back from the
+        newest).  Raises IndexError if there is no such item."""
+        nitems = len(self._buffer)
         if index < 0:   # If index is negative, convert to positive
-            index = self.getNumItems() + index
-            if index < 0:   # If it's still negative, it's out of range
-                raise IndexError("Buffer index out of range.")
-                return None
-        if index > self._depth - 1:
+            index += nitems
+        if not 0 <= index < nitems:
             raise IndexError("Buffer index out of range.")
-            return None
-        if index <= (self.getNumItems() - 1):
-            index = (index + self._getPtr) % self._depth
-            return index
-        return None
+        return index
 
     def _convertSetIndex(self, index):
-        if index > self._depth - 1:
-            raise IndexError("Buffer index out of range.")
-            return None
-        if index <= (self.getNumItems() - 1):
-            index = (index + self._depth - 1 - self._getPtr) % self._depth
-            return index
-        else:
+        return self._convertGetIndex(index)
+
+    def snapshot(self):
+        """Return a list of the stored items in index order (without removing them)."""
+        return list(self._buffer)
+
+    def __str__(self):
+        return '[' + ','.join(map(str, self.snapshot())) + ']'
+
+    def __repr__(self):
+        return self.__str__()
+
+class NpFifo(object):
+    __slots__ = ('_depth', '_blockOnFull', '_buffer', '_head', '_count')
+    def __init__(self, bufferDepth = 3, blockOnFull = True, dtype = None):
+        """A FIFO of numbers backed by a preallocated numpy array so statistics over
+        the stored values (e.g. mean()) run in numpy rather than Python.  Same
+        add/get/index interface as FIFO.  Requires numpy."""
+        if np is None:
+            raise ImportError("NpFifo requires numpy")
+        if dtype is None:
+            dtype = np.float64
+        self._depth = int(bufferDepth)
+        self._blockOnFull = blockOnFull
+        self._buffer = np.zeros(self._depth, dtype)
+        self._head = 0      # Index of the next write
+        self._count = 0
+
+    def reset(self):
+        self._head = 0
+        self._count = 0
+
+    def add(self, item):
+        """Add an item to the buffer.  Returns False if full and blocking, else True
+        (the oldest item is overwritten if full and non-blocking)."""
+        if self._count == self._depth:
+            if self._blockOnFull:
+                return False
+            self._count -= 1
+        head = self._head
+        self._buffer[head] = item
+        head += 1
+        if head == self._depth:
+            head = 0
+        self._head = head
+        self._count += 1
+        return True
+
+    def addMany(self, items):
+        """Add each of the numbers in 'items' in order with numpy slice copies rather
+        than one add() per item.  Returns False if a blocking buffer filled up (the
+        items which fit are added; the rest are not), else True."""
+        arr = np.asarray(items, dtype = self._buffer.dtype).ravel()
+        allAdded = True
+        if self._blockOnFull:
+            free = self._depth - self._count
+            if len(arr) > free:
+                arr = arr[:free]
+                allAdded = False
+        elif len(arr) > self._depth:
+            # Only the last 'depth' items survive; skip the head past the rest
+            self._head = (self._head + len(arr) - self._depth) % self._depth
+            arr = arr[-self._depth:]
+        n = len(arr)
+        first = min(n, self._depth - self._head)
+        self._buffer[self._head:self._head + first] = arr[:first]
+        self._buffer[:n - first] = arr[first:]
+        self._head = (self._head + n) % self._depth
+        self._count = min(self._count + n, self._depth)
+        return allAdded
+
+    def get(self):
+        """Get the next (oldest) item in the buffer or None if empty."""
+        if self._count == 0:
             return None
+        item = self._buffer[(self._head - self._count) % self._depth]
+        self._count -= 1
+        return item.item()
+
+    def isFull(self):
+        return self._count == self._depth
+
+    def isEmpty(self):
+        return self._count == 0
+
+    def getNumItems(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("Buffer index out of range.")
+        return self._buffer[(self._head - self._count + index) % self._depth].item()
+
+    def values(self):
+        """Return a numpy array of the stored items, oldest to newest."""
+        start = (self._head - self._count) % self._depth
+        if start + self._count <= self._depth:
+            return self._buffer[start:start + self._count]
+        return np.concatenate((self._buffer[start:], self._buffer[:self._head]))
+
+    def snapshot(self):
+        """Return a list of the stored items, oldest to newest."""
+        return self.values().tolist()
+
+    def mean(self):
+        if self._count == self._depth:
+            return self._buffer.mean()
+        return self.values().mean()
 
     def __str__(self):
-        f = []
-        for n in range(self.getNumItems()):
-            f.append(str(self.__getitem__(n)))
-        if len(f) == 0:
-            return '[]'
-        return '[' + ','.join(f) + ']'
+        return '[' + ','.join(map(str, self.snapshot())) + ']'
 
     def __repr__(self):
         return self.__str__()
 
 class Stack(FIFO):
-    """In a First-In-Last-Out (FILO/LIFO) buffer, if the add and get pointers are
-    equal, it's empty.  Otherwise, the add pointer should always be 1 ahead of the
-    get pointer.
+    """A First-In-Last-Out (FILO/LIFO) buffer.  Items are pushed and popped at the
+    front of the deque, so index 0 is the most-recently added item and, when full
+    and non-blocking, the oldest item falls off the end.
     This Stack implementation also pegs its index at both ends.
     A negative index where abs(index) > numEntries will always return item 0.
-    A positive index > numEntries will always return item -1."""
-    def __init__(self, bufferDepth = 3, blockOnFull = True):
-        super().__init__(bufferDepth, blockOnFull)
-        self._numItems = 0
+    A positive index > numEntries will always return item -1.
+    Indexing an empty Stack raises IndexError."""
+    __slots__ = ()
+    def _addBlocking(self, item):
+        """Add an item to the buffer (blocking buffer).
+        if full, returns False
+        else, returns True"""
+        buf = self._buffer
+        if len(buf) == self._depth:
+            return False
+        buf.appendleft(item)
+        return True
 
-    def reset(self):
-        self._addPtr = 0
-        self._getPtr = 0
-        self._numItems = 0
-        self._empty = True
+    def _addShifting(self, item):
+        """Add an item to the buffer (non-blocking buffer).
+        always returns True
+        if Full, the oldest item will be forgotten (garbage-collected)"""
+        self._buffer.appendleft(item)
+        return True
+
+    def _extend(self, items):
+        self._buffer.extendleft(items)
+
+    def __getitem__(self, index):
+        return self._buffer[self._convertGetIndex(index)]
 
     def _convertGetIndex(self, index):
-        nitems = self.getNumItems()
+        nitems = len(self._buffer)
         if nitems == 0:
-            return None
-        if index < 0:   # If index is negative, convert to positive
-            index = nitems - (abs(index) % nitems)
+            raise IndexError("Cannot get item at index {} because the stack is empty.".format(index))
         # We don't want people peeking on memory that "doesn't exist"
-        index = (self._getPtr - min(index, nitems-1)) % self._depth
+        if index < 0:   # If index is negative, convert to positive (pegged at 0)
+            index = max(0, nitems + index)
+        elif index >= nitems:
+            index = nitems - 1
         return index
 
     def _convertSetIndex(self, index):
-        nitems = self.getNumItems()
+        nitems = len(self._buffer)
         if nitems == 0:
             raise IndexError("Cannot set item at index {} because the entry does not exist.".format(index))
-            return None
         if index < 0:   # If index is negative, convert to positive
-            index = nitems - (abs(index) % nitems)
-        if index <= (nitems - 1):
-            index = (self._getPtr - index) % self._depth
-            #index = (index + self._depth - 1 - self._getPtr) % self._depth
-            return index
-        else:
+            index += nitems
+        if not 0 <= index < nitems:
             raise IndexError("Cannot set item at index {} because the entry does not exist.".format(index))
-            return None
-
-    def isFull(self):
-        if self._numItems == self._depth:
-            return True
-        return False
-
-    def add(self, item):
-        """Add an item to the buffer.
-        Blocking Buffer:
-            if full, returns False
-            else, returns True
-        Non-blocking Buffer:
-            always returns True
-            if Full, the next item to 'get' will be forgotten (garbage-collected)"""
-        # Check for full
-        if self.isFull():
-            if self._blockOnFull:
-                return False
-            else:
-                # Decrement _numItems because it will be incremented by _incPtrs
-                self._numItems -= 1
-        self._buffer[self._addPtr] = item
-        # Increment (wrap if necessary) pointers
-        self._incPtrs()
-        # It is now not empty
-        self._empty = False
-        return True
-
-    def get(self):
-        """Get the next item in the buffer.
-        If empty, returns None
-        Else, returns the item"""
-        # Check for empty
-        if self.isEmpty():
-            return None
-        # Fetch the item to return
-        item = self._buffer[self._getPtr]
-        # Decrement pointers
-        self._decPtrs()
-        # Now if pointers are equal, we must be empty
-        if self._numItems == 0:
-            self._empty = True
-        return item
-
-    def getNumItems(self):
-        """Get the number of items currently in the buffer.  Will always
-        return a number between 0 and bufferDepth - 1"""
-        return self._numItems
-
-    def _incPtrs(self):
-        """A Stack should set the get pointer to the previous location of the add ptr on
-        increment."""
-        self._getPtr = self._addPtr
-        self._addPtr = (self._addPtr + 1) % self._depth
-        self._numItems += 1
-
-    def _decPtrs(self):
-        """A Stack should set the add pointer to the previous location of the get ptr on
-        decrement."""
-        self._addPtr = self._getPtr
-        self._getPtr = (self._getPtr - 1) % self._depth
-        self._numItems -= 1
+        return index
 
 def _testFIFO(argv):
     blockOnFull = input("Block FIFO on full buffer [T/F]: ?")
@@ -297,7 +333,7 @@ def _testFIFO(argv):
                 print("Result: {}".format(result))
             elif query.lower()[0] == 'g':
                 result = fifo.get()
-                if result == None:
+                if result is None:
                     print("Buffer is empty")
                 else:
                     print("Got: {}".format(result))
@@ -321,8 +357,9 @@ def _doFifoTestNonBlocking(argv):
     _b = ["H", "I", "J", "K"]
     fifo = FIFO(len(_s), blockOnFull=False)
     passed = True
+    add = fifo.add
     for item in _s:
-        if fifo.add(item):
+        if add(item):
             print("Adding {}, len = {}".format(item, len(fifo)))
         else:
             print("Could not add {}".format(item))
@@ -332,7 +369,7 @@ def _doFifoTestNonBlocking(argv):
         print(item)
     print("Adding more...")
     for item in _b:
-        if fifo.add(item):
+        if add(item):
             print("Adding {}, len = {}".format(item, len(fifo)))
         else:
             print("Could not add {}".format(item))
@@ -367,7 +404,7 @@ def _testStack(argv):
                 print("Result: {}".format(result))
             elif query.lower()[0] == 'g':
                 result = stack.get()
-                if result == None:
+                if result is None:
                     print("Buffer is empty")
                 else:
                     print("Got: {}".format(result))
@@ -391,8 +428,10 @@ def _doStackTestBlocking(argv):
     _b = ["H", "I", "J", "K"]
     stack = Stack(len(_s), blockOnFull=True)
     passed = True
+    add = stack.add
+    get = stack.get
     for item in _s:
-        if stack.add(item):
+        if add(item):
             print("Adding {}, len = {}".format(item, len(stack)))
         else:
             print("Could not add {}".format(item))
@@ -408,7 +447,7 @@ def _doStackTestBlocking(argv):
     toAdd = len(_b) # Add more to test blocking/shifting
     print("Adding {} more".format(toAdd))
     for item in _b:
-        stack.add(item)
+        add(item)
     print(stack)
     print("Checking indices...")
     for n in range(l):
@@ -424,8 +463,8 @@ def _doStackTestBlocking(argv):
             print("Hit loop limit")
             passed = False
             break
-        item = stack.get()
-        if item == None:
+        item = get()
+        if item is None:
             break
         print("Got {}. len = {}".format(item, len(stack)))
     print("Adding one more")
@@ -449,8 +488,10 @@ def _doStackTestNonBlocking(argv):
     _b = ["H", "I", "J", "K"]
     stack = Stack(len(_s), blockOnFull=False)
     passed = True
+    add = stack.add
+    get = stack.get
     for item in _s:
-        if stack.add(item):
+        if add(item):
             print("Adding {}, len = {}".format(item, len(stack)))
         else:
             print("Could not add {}".format(item))
@@ -465,7 +506,7 @@ def _doStackTestNonBlocking(argv):
     toAdd = len(_b) # Add more to test blocking/shifting
     print("Adding {} more".format(toAdd))
     for item in _b:
-        stack.add(item)
+        add(item)
     print(stack)
     print("Checking indices...")
     for n in range(l):
@@ -484,8 +525,8 @@ def _doStackTestNonBlocking(argv):
             print("Hit loop limit")
             passed = False
             break
-        item = stack.get()
-        if item == None:
+        item = get()
+        if item is None:
             break
         print("Got {}. len = {}".format(item, len(stack)))
     print("Adding one more")
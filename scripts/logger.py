@@ -10,35 +10,43 @@ NONE_DEFAULT = "(None)"
 LOGFILE_EXTENSION = ".txt"
 
 class Logger():
+    __slots__ = ('filename', 'filedir', 'filepath', 'separator', '_terminator', '_logItems',
+                 '_getters', '_startNs', '_isEmpty', '_fd', '_pending', '_flushEvery')
     _kwEvent = "EVENT"
     _kwNote  = "NOTE"
-    def __init__(self, filename = None, filedir = None, separator = ',', terminator = '\n'):
+    def __init__(self, filename = None, filedir = None, separator = ',', terminator = '\n', flushEvery = 1):
+        """Log lines are written to the file in batches of 'flushEvery' (events and
+        notes are always written immediately)."""
         self.filename = filename
         self.filedir = filedir
         self.separator = separator
         self._terminator = terminator
         self._logItems = []
-        if self.filename == None:
+        self._getters = []      # Getter functions of _logItems, in order
+        if self.filename is None:
             self.filename = self._generateFilename()
         self.filename, self.filepath = self._createAndJoin(name = self.filename, fdir = self.filedir)
-        self._startTime = time.time()
+        self._startNs = time.monotonic_ns()
         self._isEmpty = True
+        self._fd = None
+        self._pending = []      # Lines not yet written to the file
+        self._flushEvery = max(1, int(flushEvery))
 
     @staticmethod
     def _createAndJoin(name = "", fdir = "."):
-        if fdir == None:
+        if fdir is None:
             fdir = ""
         if fdir != "":
-            if not os.path.exists(fdir):
-                os.mkdir(fdir)
+            try:
+                os.makedirs(fdir, exist_ok = True)
+            except OSError:
+                pass
             if not os.path.isdir(fdir):
                 print("{} is not a directory. Defaulting to parent directory.".format(fdir))
                 fdir = ""
         # Ensure the filename has the correct extension
-        filenameStem, ext = os.path.splitext(name)
-        print("filenameStem = {}, ext = {}".format(filenameStem, ext))
-        filename = filenameStem + LOGFILE_EXTENSION
-        filepath = os.path.join(fdir, name)
+        filename = os.path.splitext(name)[0] + LOGFILE_EXTENSION
+        filepath = os.path.join(fdir, filename)
         return (filename, filepath)
 
     @staticmethod
@@ -48,32 +56,32 @@ class Logger():
         return "logfile_{}_{}{}".format(datestring, timestring, LOGFILE_EXTENSION)
 
     def addLogItem(self, label, getter, index = None):
-        if index == None:
+        if index is None:
             self._logItems.append(LogItem(label, getter))
         else:
             index = min(index, len(self._logItems))
             self._logItems.insert(index, LogItem(label, getter))
+        self._getters = [logItem._getter for logItem in self._logItems]
         return len(self._logItems)
 
     def begin(self):
         datestring, timestring = getDateTimeString(TIME_FORMAT_MDY)
         s = "# {} - Log file created on {} at {} with logger.py{}".format(
                 self.filename, datestring, timestring, self._terminator)
-        with open(self.filepath, 'w') as fd:
-            fd.write(s)
-        self._startTime = time.time()
-        self._writeHeader()
+        self.close()
+        # Kept open (line-buffered) for the life of the log rather than reopened per line
+        self._fd = open(self.filepath, 'w', buffering = 1)
+        self._fd.write(s + self._headerLine() + self._terminator)
+        self._startNs = time.monotonic_ns()
+        # Consider a header line to be only at the start of a file
+        self._isEmpty = True
         return
 
-    def _writeHeader(self):
+    def _headerLine(self):
         l = ["Time (s)"]
         for logItem in self._logItems:
             l.append(logItem.getLabel())
-        s = self.separator.join(l)
-        #print(s)
-        self._writeLine(s)
-        # Consider a header line to be only at the start of a file
-        self._isEmpty = True
+        return self.separator.join(l)
 
     def _terminate(self, string):
         if not string.endswith(self._terminator):
@@ -81,21 +89,47 @@ class Logger():
         return string
 
     def _writeLine(self, string):
-        string = self._terminate(string)
-        with open(self.filepath, 'a') as fd:
-            fd.write(string)
+        """Queue 'string', which must already end with the terminator, and write the
+        queue out once it holds 'flushEvery' lines."""
+        pending = self._pending
+        pending.append(string)
         self._isEmpty = False
+        if len(pending) >= self._flushEvery:
+            self._writePending()
+        return
+
+    def _writePending(self):
+        if not self._pending:
+            return
+        if self._fd is None:
+            self._fd = open(self.filepath, 'a', buffering = 1)
+        # One write (and so one flush of the line buffer) for the whole batch
+        self._fd.write(''.join(self._pending))
+        self._pending.clear()
+        return
+
+    def flush(self):
+        """Write any queued lines and flush them to the log file."""
+        self._writePending()
+        if self._fd is not None:
+            self._fd.flush()
+        return
+
+    def close(self):
+        """Close the log file (after writing any queued lines).  A subsequent log
+        line reopens it in append mode."""
+        self._writePending()
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
         return
 
     def log(self):
-        l = ["{:.03f}".format(self._now())]
-        for logItem in self._logItems:
-            s = logItem.get()
-            if s == None:
-                s = NONE_DEFAULT
-            l.append(s)
-        s = self.separator.join(l)
-        self._writeLine(s)
+        l = ["%.3f" % self._now()]
+        for getter in self._getters:
+            s = getter()
+            l.append(NONE_DEFAULT if s is None else s)
+        self._writeLine(self.separator.join(l) + self._terminator)
         return
 
     def event(self, string):
@@ -111,30 +145,37 @@ class Logger():
         string = self._terminate(str(string))
         s = "# {} {:.03f}: {}".format(keyword, timestamp, string)
         self._writeLine(s)
+        # Events/notes are human-visible markers, so don't leave them queued
+        self.flush()
         return
 
     def deleteIfEmpty(self):
         """Delete logfile if empty (no log lines or events, only header)."""
         if self._isEmpty:
             print("Deleting empty file {}.".format(self.filepath))
+            self.close()
             os.remove(self.filepath)
         else:
+            self.flush()
             print("File not empty {}".format(self._isEmpty))
 
     def _now(self):
-        return time.time() - self._startTime
+        """Seconds since begin().  Monotonic, so unaffected by system clock changes."""
+        return (time.monotonic_ns() - self._startNs)*1e-9
 
 
 def getDateTimeString(fmt = None):
     ts = time.localtime()
     if fmt is not None and fmt.lower() == TIME_FORMAT_MDY:
-        date = "{1}/{2}/{0}".format(ts.tm_year, ts.tm_mon, ts.tm_mday)
+        # Not zero-padded, which strftime can't do portably
+        date = "%d/%d/%d" % (ts.tm_mon, ts.tm_mday, ts.tm_year)
     else:
-        date = "{0:04}{1:02}{2:02}".format(ts.tm_year, ts.tm_mon, ts.tm_mday)
-    ltime = "{:02}:{:02}".format(ts.tm_hour, ts.tm_min)
+        date = time.strftime("%Y%m%d", ts)
+    ltime = time.strftime("%H:%M", ts)
     return (date, ltime)
 
 class LogItem():
+    __slots__ = ('label', '_getter')
     def __init__(self, label = "", getter = lambda x: ""):
         self.label = label
         self._getter = getter
@@ -165,6 +206,7 @@ def testLogger(argv):
     logger.event("Hello!")
     time.sleep(1.5)
     logger.log()
+    logger.close()
     return True
 
 if __name__ == "__main__":
@@ -9,7 +9,7 @@ dynamically."""
 #   CHECK 3. Create GUI container with '+/-' buttons to add/remove expression lines like the above
 #       3a. Limit vertical size of container with scroll bar
 #   4. Allow results of expressions "above" to be referenced in expression? (I.e. {x} yields value of expression x)
-#   5. Create safeties around 'eval' function
+#   CHECK 5. Create safeties around 'eval' function
 
 # Notes:
 #   CHECK * Add "Ok" and "Cancel" buttons to VariableDialog. Caller will only update variableIndexDict on "Ok"
@@ -26,27 +26,73 @@ import PyQt5.QtCore as qtc
 import PyQt5.QtGui as qtg
 import PyQt5.QtWidgets as qtw
 import re
+import ast
+import functools
+import collections
+import logging
 
 #Signal = qtc.Signal    # pyside
 Signal = qtc.pyqtSignal # PyQt5
+
+log = logging.getLogger(__name__)
+
+_RE_ALPHA = re.compile(r"[a-zA-Z_]")
+
+@functools.lru_cache(maxsize = 256)
+def _compileVar(name):
+    """Return the compiled pattern matching variable 'name' as a whole word."""
+    return re.compile(r"\b" + re.escape(str(name)) + r"\b")
+
+@functools.lru_cache(maxsize = 64)
+def _compileVars(names):
+    """Return one compiled pattern matching any of the variable 'names' (a sorted tuple) as a
+    whole word or, failing that, any other alphabetic character or underline (group 'other')."""
+    # Longest first so e.g. 'myVar10' is tried before 'myVar1'
+    names = sorted(names, key = len, reverse = True)
+    other = r"(?P<other>[a-zA-Z_])"
+    if len(names) == 0:
+        return re.compile(other)
+    return re.compile(r"\b(?:" + '|'.join([re.escape(str(name)) for name in names]) + r")\b|" + other)
+
+# The only syntax allowed in an expression: arithmetic, comparisons and conditionals over
+# constants and variable names (no calls, attributes, subscripts, assignments, etc.)
+_SAFE_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+               ast.Constant, ast.Name, ast.Load, ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+
+@functools.lru_cache(maxsize = 256)
+def _compileExpression(expressionText):
+    """Return the code object of 'expressionText', compiled once per distinct text.  Variables
+    are left as names to be looked up in the locals passed to eval().  Raises ValueError if
+    the expression uses anything other than _SAFE_NODES."""
+    # Parsed once, checked, then compiled from the same tree
+    tree = ast.parse(expressionText, mode = 'eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _SAFE_NODES):
+            raise ValueError("{} not allowed".format(type(node).__name__))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError("Constant {!r} not allowed".format(node.value))
+    return compile(tree, '<math>', 'eval')
  
 class GUIMathModuleDialog(qtw.QDialog):
     _moduleLabel = "Math Module"
+    _evalCacheSize = 512
     def __init__(self, parent = None, labelGetterPairs = [], nameIndexPairs = [], expressions = []):
         super().__init__()
         self.setWindowTitle(self._moduleLabel)
         self._initialized = False
         self.parent = parent
-        # labelGetterPairs is [(label, getterFunction), ...] in widget line order (for accessing via line index)
-        self.labelGetterPairs = list(labelGetterPairs)
-        # labelGetterDict is {label : getterFunction, ...} in no order (for accessing getter via label)
-        self.labelGetterDict = {}
-        self.expressions = list(expressions)
-        self._labels = [x[0] for x in self.labelGetterPairs]
-        self._getters = [x[1] for x in self.labelGetterPairs]
-        self.nameIndexPairs = list(nameIndexPairs)
-        for label, getter in self.labelGetterPairs:
-            self.labelGetterDict[label] = getter
+        # Stored as tuples since they are only ever replaced, never modified in place
+        pairs = tuple(labelGetterPairs)
+        # _labels/_getters are in widget line order (for accessing via line index), duplicates included
+        self._labels = tuple([x[0] for x in pairs])
+        self._getters = tuple([x[1] for x in pairs])
+        # labelGetterDict is {label : getterFunction, ...} (for accessing getter via label)
+        self.labelGetterDict = dict(pairs)
+        self._variableNames = None  # Names applied by _updateGetters(), in order
+        self.expressions = tuple(expressions)
+        self.nameIndexPairs = tuple(nameIndexPairs)
+        # (expressionText, variable values) : result, oldest first
+        self._evalCache = collections.OrderedDict()
         self.create()
 
     def create(self):
@@ -60,18 +106,27 @@ class GUIMathModuleDialog(qtw.QDialog):
         self._initialized = True
         self.show()
 
+    @property
+    def labelGetterPairs(self):
+        """[(label, getterFunction), ...] as passed in or, once variables have been applied,
+        [(variableName, getterFunction), ...] for the applied variables."""
+        if self._variableNames is None:
+            return list(zip(self._labels, self._getters))
+        return [(name, self.labelGetterDict[name]) for name in self._variableNames]
+
     def _getNameIndexPairs(self):
         self.nameIndexPairs = self.variableWidget.getNameIndexPairs()
 
     def _updateGetters(self):
-        self.labelGetterPairs = []
+        names = []
         for n in range(len(self.nameIndexPairs)):
             name, index = self.nameIndexPairs[n]
             if (index >= 0) and (index < len(self._getters)):
-                print("name = {}, index = {}".format(name, index))
+                log.debug("name = %s, index = %s", name, index)
                 self.labelGetterDict[name] = self._getters[index]
-                self.labelGetterPairs.append((name, self._getters[index]))
-        print("nameIndexPairs = {}".format(self.nameIndexPairs))
+                names.append(name)
+        self._variableNames = tuple(names)
+        log.debug("nameIndexPairs = %s", self.nameIndexPairs)
 
     def onVariableWidgetButton(self, choice):
         if choice == VariableBox._closeApply:
@@ -80,62 +135,97 @@ class GUIMathModuleDialog(qtw.QDialog):
             self._updateGetters()
 
     def evaluate(self):
+        """Evaluate all expressions and return a list of their results (None for any
+        expression which could not be evaluated)."""
         exprList = self.expressionWidget.getExpressionList()
+        # Each getter is called once for the whole batch rather than once per expression
+        values = self._getValueDict()
+        results = []
         for expr in exprList:
-            self._evaluateExpression(expr)
-        return
-
-    def _evaluateExpression(self, expressionText):
-        # 1. Get expression text from expression line 'lineNum'
-        # TODO
-        exprFiltered, errorChars = self._replaceVariables(expressionText)
-        # 2. String-replace all variables in expression with numeric values
-        #   2a. On syntax error: expressionLines[lineNum].highlightCharacters(nStart, nStop)
-        # 3. Verify no alphabetic characters remain in filtered expression
-        #   3a. If alphabetic characters remain, expressionLines[lineNum].highlightCharacters(nStart, nStop)
-        # 4. result = eval(exprFiltered)
-        # 5. expressionLines[lineNum].setResult(result)
-        return
-
-    def _replaceVariables(self, expressionText):
+            results.append(self._evaluateExpression(expr, values))
+        return results
+
+    def _evaluateExpression(self, expressionText, values = None):
+        """'values' is a dict of variable names and values (as from _getValueDict()) and
+        defaults to the current values."""
+        if values is None:
+            values = self._getValueDict()
+        # The result only depends on the text and the variable values
+        key = (expressionText, tuple(values.items()))
+        try:
+            return self._evalCache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            key = None  # A value (e.g. a list or numpy array) is unhashable, so not cached
+        result = None
+        try:
+            # Variables are passed as locals rather than substituted into the text, so
+            # the text is only compiled once however often the values change
+            result = eval(_compileExpression(expressionText), {'__builtins__': {}}, values)
+        except NameError:
+            # Find the first unknown name to report
+            exprFiltered, errorChars = self._replaceVariables(expressionText,
+                    {label: str(val) for label, val in values.items()})
+            # TODO expressionLines[lineNum].highlightCharacters(nStart, nStop)
+            log.warning("Invalid text at %s in expression %s", errorChars, expressionText)
+        except Exception as e:
+            log.warning("Could not evaluate %s: %s", expressionText, e)
+        if key is not None:
+            self._evalCache[key] = result
+            if len(self._evalCache) > self._evalCacheSize:
+                self._evalCache.popitem(last = False)
+        return result
+
+    def _replaceVariables(self, expressionText, replaceDict = None):
         """Should return (exprStringFiltered, errorChars) where errorChars = (start, end) indices of
         first invalid text encountered (does not match variable and is not numeric or puctual).
-        If errorChars == None, the replacement was successful."""
-        # TODO
-        return "", None
+        If errorChars == None, the replacement was successful.
+        'replaceDict' defaults to the current _getReplaceDict()."""
+        if _RE_ALPHA.search(expressionText) is None:
+            # Plain arithmetic: nothing to replace and no invalid names (and no getters called)
+            return expressionText, None
+        if replaceDict is None:
+            replaceDict = self._getReplaceDict()
+        d = replaceDict
+        errorChars = []
+        def replace(match):
+            if match.lastgroup == 'other':
+                if len(errorChars) == 0:
+                    errorChars.append(match.span())
+                return match.group(0)
+            return d[match.group(0)]
+        # All variables are replaced in a single scan of the expression
+        exprFiltered = _compileVars(tuple(sorted(d))).sub(replace, expressionText)
+        if len(errorChars) == 0:
+            return exprFiltered, None
+        return exprFiltered, errorChars[0]
 
     @staticmethod
     def _replaceVariable(s, varFrom, varTo):
-        regexp = r"\b" + str(varFrom) + r"\b"
-        #r = re.compile(regexp)
-        print("Looking for {}".format(regexp))
-        matches = re.finditer(regexp, s)
-        l = []
-        lastIndex = 0
-        matched = False
-        for match in matches:
-            matched = True
-            start, end = match.span()
-            l.append(s[lastIndex:start])
-            l.append(varTo)
-            lastIndex = end
-        if lastIndex < len(s) - 1:
-            l.append(s[lastIndex:])
-        if matched:
-            return ''.join(l)
-        return s
+        r = _compileVar(varFrom)
+        log.debug("Looking for %s", r.pattern)
+        # A function replacement so 'varTo' is inserted literally (no backslash escapes)
+        return r.sub(lambda match: varTo, s)
 
     @staticmethod
-    def _isAllNumeric(s):
+    def _isAllNumeric(s, _search = _RE_ALPHA.search):
         """Returns (True, None) if string 's' contains no alphabetic characters or underlines
         else returns (False, (indexStart, indexStop)) indicating the first span an alphabetic character
         match."""
-        r = re.compile("[a-zA-Z_]")
-        s = r.search(s)
+        # The precompiled search beats a per-character Python scan or str.translate here
+        s = _search(s)
         if s:
             return False, s.span()
         return True, None
 
+    def _getValueDict(self):
+        """Returns a dictionary of variable names associated with their most-recent value."""
+        d = {}
+        for label, getter in self.labelGetterDict.items():
+            d[label] = getter()
+        return d
+
     def _getReplaceDict(self):
         """Returns a replacement dictionary object of variable names associated with their most-recent
         value (in string form)."""
@@ -200,7 +290,7 @@ class GUIMathModule(qtw.QWidget):
         self._dlgVariables = None
 
     def onVariableDialogButton(self, choice):
-        print("choice = {}".format(choice))
+        log.debug("choice = %s", choice)
         close = False
         fetch = False
         if choice == VariableDialog._closeOk:
@@ -220,9 +310,9 @@ class GUIMathModule(qtw.QWidget):
     def _updateGetters(self):
         for name, index in self._nameIndexPairs:
             if (index >= 0) and (index < len(self._getters)):
-                print("name = {}, index = {}".format(name, index))
+                log.debug("name = %s, index = %s", name, index)
                 self._variableGetters[name] = self._getters[index]
-        print("_nameIndexPairs = {}".format(self._nameIndexPairs))
+        log.debug("_nameIndexPairs = %s", self._nameIndexPairs)
 
     def create(self):
         groupBox = qtw.QGroupBox(self._moduleLabel, self)
@@ -236,7 +326,37 @@ class GUIMathModule(qtw.QWidget):
         self.setLayout(vbox)
         self._initialized = True
 
-class ExpressionBox(qtw.QWidget):
+class _LineBox(qtw.QWidget):
+    """Common line handling for ExpressionBox and VariableBox"""
+    _sizePending = False
+
+    def _renumberLines(self, nLine):
+        # Renumber with painting suspended so the relabels are repainted once, not per line
+        self.setUpdatesEnabled(False)
+        for n in range(nLine, len(self.lines)):
+            nOld = self.lines[n].lineNum
+            self.lines[n].setLineNum(nOld-1)
+        self.setUpdatesEnabled(True)
+
+    def updateSize(self):
+        # Deferred so that several adds/removes in one pass of the event loop share a relayout
+        if not self._sizePending:
+            self._sizePending = True
+            qtc.QTimer.singleShot(0, self._flushSize)
+
+    def _flushSize(self):
+        if not self._sizePending:
+            return
+        self._sizePending = False
+        self.updateGeometry()
+        self.setBaseSize(self.layout.totalSizeHint())
+        self.adjustSize()
+        updateParent = getattr(self.parent, 'updateSize', None)
+        if updateParent is not None:
+            updateParent()
+        #print("Layout size hint: {}".format(self.layout.totalSizeHint()))
+
+class ExpressionBox(_LineBox):
     _addLabel = '+'
     def __init__(self, parent = None, expressionList = []):
         super().__init__(parent)
@@ -283,8 +403,8 @@ class ExpressionBox(qtw.QWidget):
         if lineNum > len(self.expressionList) - 1:
             print("Somehow edited a line beyond expression list")
             return
-        self.expressionList[lineNum] = line.getExpressionText()
-        print("line {} edited. New text = {}".format(self.expressionList[lineNum]))
+        self.expressionList[lineNum] = self.lines[lineNum].getExpressionText()
+        log.debug("line %d edited. New text = %s", lineNum, self.expressionList[lineNum])
         return
 
     def onButtonAdd(self):
@@ -296,9 +416,7 @@ class ExpressionBox(qtw.QWidget):
         self.expressionList.pop(nLine)
         self.layout.removeWidget(line)
         del line
-        for n in range(nLine, len(self.lines)):
-            nOld = self.lines[n].lineNum
-            self.lines[n].setLineNum(nOld-1)
+        self._renumberLines(nLine)
         self.updateSize()
 
     def appendNewLine(self):
@@ -311,15 +429,6 @@ class ExpressionBox(qtw.QWidget):
         self.updateSize()
         return
 
-    def updateSize(self):
-        self.updateGeometry()
-        self.setBaseSize(self.layout.totalSizeHint())
-        self.adjustSize()
-        if self.parent != None:
-            if hasattr(self.parent, 'updateSize'):
-                self.parent.updateSize()
-        #print("Layout size hint: {}".format(self.layout.totalSizeHint()))
-
 class ExpressionLine(qtw.QWidget):
     delete = Signal(int)
     edit = Signal(int)
@@ -327,9 +436,14 @@ class ExpressionLine(qtw.QWidget):
     _colorDefault = 'black'
     _colorHighlight = 'red'
     _textEditHeight = 60 # Magic number!
+    _editDelayMs = 150  # A burst of keystrokes within this interval emits a single 'edit'
     def __init__(self, lineNum = 0, expression = ""):
         super().__init__(None)
         self.lineNum = lineNum
+        self._editTimer = qtc.QTimer(self)
+        self._editTimer.setSingleShot(True)
+        self._editTimer.setInterval(self._editDelayMs)
+        self._editTimer.timeout.connect(self._emitEdit)
         hbox = qtw.QHBoxLayout()
         self.labelNum = qtw.QLabel()
         self.setLineNum(lineNum)
@@ -354,6 +468,10 @@ class ExpressionLine(qtw.QWidget):
         self.labelNum.setText("{}. ".format(n))
 
     def onTextEdit(self):
+        # (Re)start the timer so 'edit' is only emitted once typing pauses
+        self._editTimer.start()
+
+    def _emitEdit(self):
         self.edit.emit(self.lineNum)
 
     def getExpressionText(self):
@@ -366,18 +484,20 @@ class ExpressionLine(qtw.QWidget):
         self.resultLabel.setText("{:.3f}".format(result))
 
 #class VariableDialog(qtw.QDialog):
-class VariableBox(qtw.QWidget):
+class VariableBox(_LineBox):
     signalClose= Signal(int)
     _closeCancel = 0
     _closeOk = 1
     _closeApply = 2
     _defaultPairs = (("x", 0),)
+    _newNames = "xyzABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvw"  # In the order handed out
     _addLabel = "+"
     def __init__(self, parent = None, nameIndexPairs = [], options = [], hasOkCancel = False):
         super().__init__(None)
         self.parent = parent
         self._hasOkCancel = hasOkCancel
         self.title = "Variables"
+        self._nextMyVar = 0     # No myVarN below this suffix is free (lowered when one is released)
         if len(nameIndexPairs) == 0:
             self.nameIndexPairs = self._defaultPairs
         else:
@@ -398,6 +518,8 @@ class VariableBox(qtw.QWidget):
             self.lines.append(line)
             self.names.append(name)
             self.layout.addWidget(line)
+        # Number of lines using each name, for duplicate checks without scanning self.names
+        self._nameCounts = collections.Counter(self.names)
         self.buttonAdd = qtw.QPushButton(self._addLabel)
         self.buttonAdd.clicked.connect(self.onButtonAdd)
         self.layout.addWidget(self.buttonAdd)
@@ -431,19 +553,19 @@ class VariableBox(qtw.QWidget):
 
     def onLineEdit(self, nLine):
         newName = self.lines[nLine].getVariableName()
-        # Store old name in case we need to put it back
         oldName = self.names[nLine]
         # Remove old name so we don't get a hit on the 'if' statement below
-        self.names[nLine] = ""
-        if newName in self.names:
+        self._releaseName(oldName)
+        if self._nameCounts[newName] > 0:
             self.lines[nLine].highlight()
-            # put old name back in list
-            self.names[nLine] = oldName
+            # put old name back
+            self._nameCounts[oldName] += 1
             # Ignore new name until changed again
         else:
             self.names[nLine] = newName
+            self._nameCounts[newName] += 1
             self.lines[nLine].unhighlight()
-        print("Line {} edited: new name {}".format(nLine, self.names[nLine]))
+        log.debug("Line %d edited: new name %s", nLine, self.names[nLine])
 
     def onButtonAdd(self):
         self.appendNewLine()
@@ -451,12 +573,10 @@ class VariableBox(qtw.QWidget):
     def removeLine(self, nLine):
         nLine = min(nLine, len(self.lines) - 1)
         line = self.lines.pop(nLine)
-        self.names.pop(nLine)
+        self._releaseName(self.names.pop(nLine))
         self.layout.removeWidget(line)
         del line
-        for n in range(nLine, len(self.lines)):
-            nOld = self.lines[n].lineNum
-            self.lines[n].setLineNum(nOld-1)
+        self._renumberLines(nLine)
         self.updateSize()
 
     def appendNewLine(self):
@@ -466,22 +586,11 @@ class VariableBox(qtw.QWidget):
         line.edit.connect(self.onLineEdit)
         self.lines.append(line)
         self.names.append(name)
+        self._nameCounts[name] += 1
         self.layout.insertWidget(len(self.lines) - 1, line)
         self.updateSize()
         return
 
-    def updateSize(self):
-        if hasattr(self, "updateGeometry"):
-            self.updateGeometry()
-        if hasattr(self, "setBaseSize"):
-            self.setBaseSize(self.layout.totalSizeHint())
-        if hasattr(self, "adjustSize"):
-            self.adjustSize()
-        if self.parent != None:
-            if hasattr(self.parent, 'updateSize'):
-                self.parent.updateSize()
-        #print("Layout size hint: {}".format(self.layout.totalSizeHint()))
-
     def getVariableIndexDict(self):
         d = {}
         for line in self.lines:
@@ -499,41 +608,38 @@ class VariableBox(qtw.QWidget):
             l.append((name, index))
         return l
 
+    def _releaseName(self, name):
+        """Drop one use of a name; a freed myVarN may be handed out again"""
+        self._nameCounts[name] -= 1
+        if (self._nameCounts[name] == 0) and name.startswith('myVar') and name[5:].isdigit():
+            self._nextMyVar = min(self._nextMyVar, int(name[5:]))
+
     def _getNewName(self):
         """Get a new (unused) variable name"""
-        x = ord('x')
-        z = ord('z')
-        A = ord('A')
-        name = None
+        nameCounts = self._nameCounts
         # Should return 'x', 'y', 'z', 'A', 'B', 'C', etc.
-        for n in range(x, x+52):
-            if n < z + 1:
-                c = chr(n)
-            else:
-                c = chr(n - z + A - 1)
-            if c not in self.names:
-                name = c
-                break
-        if name != None:
-            return name
+        for c in self._newNames:
+            if nameCounts[c] == 0:
+                return c
         # We've somehow used all alphabetic characters, try myVar0-myVar999
-        for n in range(1000):
+        for n in range(self._nextMyVar, 1000):
             name = 'myVar' + str(n)
-            if name not in self.names:
+            if nameCounts[name] == 0:
+                self._nextMyVar = n + 1
                 return name
         print("I give up")
         return None
 
     def onButtonCancel(self):
-        print("cancel")
+        log.debug("cancel")
         self.signalClose.emit(self._closeCancel)
 
     def onButtonOk(self):
-        print("ok")
+        log.debug("ok")
         self.signalClose.emit(self._closeOk)
 
     def onButtonApply(self):
-        print("apply")
+        log.debug("apply")
         self.signalClose.emit(self._closeApply)
 
 class VariableLine(qtw.QWidget):